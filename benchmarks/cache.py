@@ -0,0 +1,62 @@
+"""
+Compare the read and write throughput of the response cache backends,
+using a number of threads to mimic the worker pool.
+
+    python benchmarks/cache.py --entries 20000 --size 30000 --threads 8
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from threading import Thread
+
+from cachecontrol.caches import FileCache
+
+from scrapekit.cache import SQLiteCache
+
+
+def parallel(threads, keys, fn):
+    chunks = [keys[i::threads] for i in range(threads)]
+    workers = [Thread(target=lambda c: [fn(k) for k in c], args=(c,))
+               for c in chunks]
+    begin = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.time() - begin
+
+
+def run(backend, entries, size, threads):
+    path = tempfile.mkdtemp(prefix='scrapekit-bench-')
+    if backend == 'file':
+        cache = FileCache(os.path.join(path, 'cache'))
+    else:
+        cache = SQLiteCache(os.path.join(path, 'cache.sqlite'))
+    keys = ['http://example.com/page/%d' % i for i in range(entries)]
+    value = os.urandom(size)
+    write = parallel(threads, keys, lambda k: cache.set(k, value))
+    read = parallel(threads, keys, cache.get)
+    shutil.rmtree(path)
+    return {
+        'benchmark': 'cache',
+        'backend': backend,
+        'entries': entries,
+        'size': size,
+        'threads': threads,
+        'writes_per_second': entries / write,
+        'reads_per_second': entries / read
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--entries', type=int, default=20000)
+    parser.add_argument('--size', type=int, default=30000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+    for backend in ('file', 'sqlite'):
+        print(json.dumps(run(backend, args.entries, args.size,
+                             args.threads)))
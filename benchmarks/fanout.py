@@ -0,0 +1,64 @@
+"""
+Stress benchmark for pipeline fan-out: a single generator produces a
+large number of items, which are piped through the same pipeline as in
+``test.py`` (``funSource | funModifier > funSink``). Memory use should
+stay flat regardless of the number of items.
+
+    python benchmarks/fanout.py --items 1000000 --threads 8
+"""
+import json
+import time
+import logging
+import resource
+import argparse
+import tempfile
+from itertools import count
+
+from scrapekit import Scraper
+
+
+def run(items, threads, debug=False):
+    data_path = tempfile.mkdtemp(prefix='scrapekit-bench-')
+    scraper = Scraper('bench-fanout', config={'threads': threads,
+                                              'data_path': data_path})
+    if not debug:
+        logging.getLogger().setLevel(logging.INFO)
+    sunk = count()
+
+    @scraper.task
+    def funSource():
+        for i in range(items):
+            yield i
+
+    @scraper.task
+    def funModifier(i):
+        return i + 0.1
+
+    @scraper.task
+    def funSink(i):
+        next(sunk)
+
+    begin = time.time()
+    pipeline = funSource | funModifier > funSink
+    pipeline.run()
+    duration = time.time() - begin
+    rusage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        'benchmark': 'fanout',
+        'items': items,
+        'threads': threads,
+        'processed': next(sunk),
+        'seconds': duration,
+        'items_per_second': items / duration,
+        'max_rss_kb': rusage.ru_maxrss
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=1000000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--debug', action='store_true',
+                        help='Keep DEBUG records in the JSON log.')
+    args = parser.parse_args()
+    print(json.dumps(run(args.items, args.threads, debug=args.debug)))
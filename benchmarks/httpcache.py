@@ -0,0 +1,76 @@
+"""
+Requests per second through the HTTP cache, against the local stand-in
+server: a first pass over all pages misses the cache (and stores the
+responses), a second pass is served from the cache.
+
+    python benchmarks/httpcache.py --pages 2000 --threads 8
+"""
+import json
+import time
+import logging
+import argparse
+import tempfile
+
+from scrapekit import Scraper
+
+from server import StandInServer
+
+
+def run(pages, threads, latency=0.01, size=10000, policy='http',
+        backend='file'):
+    server = StandInServer(latency=latency, size=size).start()
+    data_path = tempfile.mkdtemp(prefix='scrapekit-bench-')
+    scraper = Scraper('bench-httpcache', config={'threads': threads,
+                                                 'pool_size': threads,
+                                                 'cache_policy': policy,
+                                                 'cache_backend': backend,
+                                                 'data_path': data_path})
+    logging.getLogger().setLevel(logging.WARNING)
+    urls = ['%s/page/%d' % (server.url, i) for i in range(pages)]
+
+    @scraper.task
+    def fetch(url):
+        scraper.get(url).content
+
+    def timed_pass():
+        begin = time.time()
+        for url in urls:
+            fetch.queue(url)
+        fetch.wait()
+        return time.time() - begin
+
+    miss = timed_pass()
+    requests = server.requests
+    hit = timed_pass()
+    server.shutdown()
+    server.server_close()
+    stats = scraper.stats()
+    return {
+        'benchmark': 'httpcache',
+        'pages': pages,
+        'threads': threads,
+        'latency': latency,
+        'size': size,
+        'policy': policy,
+        'backend': backend,
+        'miss_seconds': miss,
+        'miss_per_second': pages / miss,
+        'hit_seconds': hit,
+        'hit_per_second': pages / hit,
+        'server_requests': [requests, server.requests - requests],
+        'hit_ratio': stats['cache']['hit_ratio']
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--policy', default='http')
+    parser.add_argument('--backend', default='file')
+    args = parser.parse_args()
+    print(json.dumps(run(args.pages, args.threads, latency=args.latency,
+                         size=args.size, policy=args.policy,
+                         backend=args.backend)))
@@ -0,0 +1,75 @@
+"""
+Compare the JSON log with the compact msgpack log: the time needed to
+write a number of request-like DEBUG records through each of them, the
+resulting file size and the time needed to load the log into the index
+used for reports.
+
+    python benchmarks/logsink.py --records 200000
+"""
+import os
+import json
+import time
+import logging
+import argparse
+import tempfile
+
+from scrapekit import Scraper
+from scrapekit.logs import TaskAdapter, log_path, make_log_handler
+from scrapekit.reporting import db
+
+
+def write_log(scraper, records):
+    logger = logging.Logger('bench-logsink')
+    logger.propagate = False
+    logger.addHandler(make_log_handler(scraper))
+    log = TaskAdapter(logger, scraper)
+    scraper.task_ctx.name = 'scrape_page'
+    begin = time.time()
+    for i in range(records):
+        if i % 50 == 0:
+            scraper.task_ctx.id = 'task-%d' % i
+        url = 'http://example.com/page/%d' % (i % 1000)
+        log.debug('GET %s', url, extra={
+            'reqMethod': 'GET',
+            'reqUrl': url,
+            'reqArgs': {'headers': {'User-Agent': 'scrapekit'},
+                        'allow_redirects': True}
+        })
+    duration = time.time() - begin
+    for handler in logger.handlers:
+        handler.close()
+    return duration
+
+
+def run(log_format, records):
+    data_path = tempfile.mkdtemp(prefix='scrapekit-bench-')
+    scraper = Scraper('bench-logsink', config={'data_path': data_path,
+                                               'log_format': log_format,
+                                               'report_db': ':memory:'})
+    logging.getLogger().setLevel(logging.WARNING)
+    write = write_log(scraper, records)
+
+    begin = time.time()
+    conn = db.connect(scraper)
+    db.load(scraper, conn)
+    conn.close()
+    load = time.time() - begin
+    return {
+        'benchmark': 'logsink',
+        'log_format': log_format,
+        'records': records,
+        'write_seconds': write,
+        'records_per_second': records / write,
+        'bytes': os.path.getsize(log_path(scraper, log_format)),
+        'load_seconds': load
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--records', type=int, default=200000)
+    parser.add_argument('--format', action='append', dest='formats',
+                        choices=['json', 'msgpack'])
+    args = parser.parse_args()
+    for log_format in args.formats or ['json', 'msgpack']:
+        print(json.dumps(run(log_format, args.records)))
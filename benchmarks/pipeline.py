@@ -0,0 +1,90 @@
+"""
+End-to-end pipeline throughput against the local stand-in server: a
+source task yields page URLs, which are fetched and then parsed in a
+three-stage pipeline (``seed | fetch | parse``). Caching is disabled, so
+that every page is requested from the server. Run with several values
+for ``--threads`` to see how the worker pool scales with latency.
+
+    python benchmarks/pipeline.py --pages 2000 --threads 1 4 16 40
+"""
+import json
+import time
+import logging
+import argparse
+import tempfile
+from itertools import count
+
+from scrapekit import Scraper
+
+from server import StandInServer
+
+
+def run(pages, threads, latency=0.01, size=10000, error_rate=0.0,
+        debug=False):
+    server = StandInServer(latency=latency, size=size,
+                           error_rate=error_rate).start()
+    data_path = tempfile.mkdtemp(prefix='scrapekit-bench-')
+    scraper = Scraper('bench-pipeline', config={'threads': threads,
+                                                'pool_size': threads,
+                                                'cache_policy': 'none',
+                                                'data_path': data_path})
+    logging.getLogger().setLevel(logging.DEBUG if debug else logging.WARNING)
+    parsed, failed = count(), count()
+
+    @scraper.task
+    def seed():
+        for i in range(pages):
+            yield '%s/page/%d' % (server.url, i)
+
+    @scraper.task
+    def fetch(url):
+        response = scraper.get(url)
+        if not response.ok:
+            next(failed)
+            return []
+        return [response.text]
+
+    @scraper.task
+    def parse(text):
+        text.count('<p>')
+        next(parsed)
+
+    begin = time.time()
+    pipeline = seed | fetch | parse
+    pipeline.run()
+    duration = time.time() - begin
+    scraper.log.flush()
+    server.shutdown()
+    server.server_close()
+
+    fetch_stats = scraper.stats()['tasks'].get('fetch', {})
+    return {
+        'benchmark': 'pipeline',
+        'pages': pages,
+        'threads': threads,
+        'latency': latency,
+        'size': size,
+        'error_rate': error_rate,
+        'debug': debug,
+        'parsed': next(parsed),
+        'failed': next(failed),
+        'seconds': duration,
+        'pages_per_second': pages / duration,
+        'fetch_p95_seconds': fetch_stats.get('duration', {}).get('p95')
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pages', type=int, default=2000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[8])
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--debug', action='store_true',
+                        help='Keep DEBUG records in the JSON log.')
+    args = parser.parse_args()
+    for threads in args.threads:
+        print(json.dumps(run(args.pages, threads, latency=args.latency,
+                             size=args.size, error_rate=args.error_rate,
+                             debug=args.debug)))
@@ -0,0 +1,106 @@
+"""
+Benchmark report generation on a large, synthetic JSON log: the time
+needed to load the log into the report index, and to render all pages.
+A second report is then generated after appending a small number of
+lines, to measure the cost of an incremental update. Pages are rendered
+by ``--processes`` worker processes; compare with ``--processes 1`` to
+see the gain of parallel rendering.
+
+    python benchmarks/report.py --lines 5000000 --lines-per-task 50
+"""
+import os
+import json
+import time
+import random
+import logging
+import argparse
+import multiprocessing
+import tempfile
+from uuid import uuid4
+from datetime import datetime
+
+from scrapekit import Scraper
+from scrapekit.logs import log_path
+from scrapekit.reporting import db, generate
+
+LEVELS = ['DEBUG'] * 20 + ['INFO'] * 5 + ['WARNING', 'ERROR']
+TASKS = ['scrape_index', 'scrape_page', 'parse_page', 'store_record']
+
+
+def write_log(scraper, lines, lines_per_task):
+    scraper_id = str(uuid4())
+    start = datetime.utcnow().isoformat()
+    with open(log_path(scraper), 'a') as fh:
+        for i in range(lines):
+            if i % lines_per_task == 0:
+                task_id = str(uuid4())
+                task_name = random.choice(TASKS)
+            record = {
+                'asctime': '2014-08-26 15:58:03,%03d' % (i % 1000),
+                'levelname': random.choice(LEVELS),
+                'message': 'GET http://example.com/page/%d' % i,
+                'name': scraper.name,
+                'scraperName': scraper.name,
+                'scraperId': scraper_id,
+                'scraperStartTime': start,
+                'taskName': task_name,
+                'taskId': task_id,
+                'reqUrl': 'http://example.com/page/%d' % i
+            }
+            fh.write(json.dumps(record) + '\n')
+
+
+def count_pages(path):
+    return sum(len(files) for (_, _, files) in os.walk(path))
+
+
+def run(lines, lines_per_task, append, processes):
+    data_path = tempfile.mkdtemp(prefix='scrapekit-bench-')
+    scraper = Scraper('bench-report', config={'data_path': data_path,
+                                              'report_processes': processes})
+    logging.getLogger().setLevel(logging.WARNING)
+    write_log(scraper, lines, lines_per_task)
+
+    # loading alone, into a throw-away index.
+    memory = Scraper('bench-report', config={'data_path': data_path,
+                                             'report_db': ':memory:'})
+    begin = time.time()
+    conn = db.connect(memory)
+    db.load(memory, conn)
+    conn.close()
+    load = time.time() - begin
+
+    begin = time.time()
+    generate(scraper)
+    full = time.time() - begin
+    pages = count_pages(os.path.join(data_path, 'reports'))
+
+    write_log(scraper, append, lines_per_task)
+    begin = time.time()
+    generate(scraper)
+    incremental = time.time() - begin
+    return {
+        'benchmark': 'report',
+        'lines': lines,
+        'lines_per_task': lines_per_task,
+        'load_seconds': load,
+        'lines_per_second': lines / load,
+        'processes': processes,
+        'report_seconds': full,
+        'pages': pages,
+        'pages_per_second': pages / full,
+        'incremental_lines': append,
+        'incremental_seconds': incremental
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--lines', type=int, default=5000000)
+    parser.add_argument('--lines-per-task', type=int, default=50)
+    parser.add_argument('--append', type=int, default=1000)
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+    print(json.dumps(run(args.lines, args.lines_per_task, args.append,
+                         args.processes)))
@@ -0,0 +1,151 @@
+"""
+Run the complete benchmark suite and write the results as a single
+JSON document, along with the versions of scrapekit and Python they
+were taken with. Results can be compared against an earlier run, to
+catch regressions between releases: the script then exits with an
+error if any throughput (``*_per_second``) dropped, or any duration
+(``*_seconds``) grew, by more than the given tolerance.
+
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --compare results.json --tolerance 0.2
+
+Use ``--scale`` to run shorter (e.g. ``0.1``) or longer benchmarks,
+and ``--only`` to select benchmarks by name.
+"""
+import sys
+import json
+import platform
+import argparse
+import multiprocessing
+from datetime import datetime
+
+import pkg_resources
+
+import cache
+import fanout
+import report
+import logsink
+import pipeline
+import httpcache
+
+# Parameters which identify a result, used to match it with the same
+# benchmark in another run.
+KEY_FIELDS = ('benchmark', 'threads', 'backend', 'log_format', 'debug',
+              'policy', 'processes')
+
+
+def suite(scale):
+    def n(value):
+        return max(1, int(value * scale))
+
+    for threads in (1, 4, 16, 40):
+        yield pipeline.run, dict(pages=n(2000), threads=threads)
+    yield pipeline.run, dict(pages=n(2000), threads=16, debug=True)
+    for backend in ('file', 'sqlite'):
+        yield httpcache.run, dict(pages=n(2000), threads=8, backend=backend)
+        yield cache.run, dict(backend=backend, entries=n(20000),
+                              size=30000, threads=8)
+    yield fanout.run, dict(items=n(200000), threads=8)
+    yield report.run, dict(lines=n(100000), lines_per_task=50,
+                           append=n(1000),
+                           processes=multiprocessing.cpu_count())
+    for log_format in ('json', 'msgpack'):
+        yield logsink.run, dict(log_format=log_format, records=n(100000))
+
+
+def _child(queue, fn, kwargs):
+    try:
+        queue.put(fn(**kwargs))
+    except Exception as exc:
+        queue.put({'benchmark': fn.__module__, 'error': repr(exc)})
+
+
+def isolated(fn, kwargs):
+    """ Run a benchmark in a fresh process, so that the loggers and
+    threads set up by earlier benchmarks do not affect it. """
+    context = multiprocessing.get_context('fork')
+    queue = context.SimpleQueue()
+    process = context.Process(target=_child, args=(queue, fn, kwargs))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def result_key(result):
+    return tuple(result.get(k) for k in KEY_FIELDS)
+
+
+def compare(results, baseline, tolerance):
+    """ Find the metrics which got worse than in the baseline by more
+    than ``tolerance`` (a fraction). """
+    previous = dict((result_key(r), r) for r in baseline['results'])
+    regressions = []
+    for result in results:
+        before = previous.get(result_key(result))
+        if before is None:
+            continue
+        for name, value in result.items():
+            old = before.get(name)
+            if not isinstance(value, (int, float)) or \
+                    not isinstance(old, (int, float)) or old <= 0:
+                continue
+            if name.endswith('_per_second'):
+                change = (old - value) / float(old)
+            elif name.endswith('_seconds'):
+                change = (value - old) / float(old)
+            else:
+                continue
+            if change > tolerance:
+                regressions.append({'benchmark': result['benchmark'],
+                                    'key': result_key(result),
+                                    'metric': name,
+                                    'baseline': old,
+                                    'value': value,
+                                    'change': change})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--scale', type=float, default=1.0)
+    parser.add_argument('--only', nargs='+', default=None)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None)
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = []
+    for fn, kwargs in suite(args.scale):
+        name = fn.__module__
+        if args.only and name not in args.only:
+            continue
+        sys.stderr.write('Running %s %r\n' % (name, kwargs))
+        results.append(isolated(fn, kwargs))
+
+    document = {
+        'version': pkg_resources.require('scrapekit')[0].version,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': multiprocessing.cpu_count(),
+        'date': datetime.utcnow().isoformat(),
+        'scale': args.scale,
+        'results': results
+    }
+    if args.compare is not None:
+        with open(args.compare, 'r') as fh:
+            baseline = json.load(fh)
+        document['regressions'] = compare(results, baseline, args.tolerance)
+
+    text = json.dumps(document, indent=2)
+    if args.output is not None:
+        with open(args.output, 'w') as fh:
+            fh.write(text)
+    else:
+        print(text)
+    if document.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""
+A local HTTP server which stands in for a web site in the benchmarks.
+It serves HTML pages of a given size for any path, after a given
+latency, and fails a given share of the requests with a server error.
+Pages can be cached for an hour and support ETag revalidation. They are
+also served in parts (for ``Range`` requests) and compressed (if the
+client accepts ``gzip``). Large files of any size can be downloaded
+from ``/files/<size>``: they are streamed from sparse files, so they
+take neither memory nor disk space. The test suite uses the same server.
+
+    python benchmarks/server.py --port 8000 --latency 0.05 --size 20000
+"""
+import os
+import gzip
+import time
+import shutil
+import tempfile
+import random
+import argparse
+import threading
+from hashlib import md5
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+        if server.latency > 0:
+            time.sleep(server.latency)
+        if server.error_rate > 0 and random.random() < server.error_rate:
+            self.respond(500, b'error')
+            return
+        if self.path.startswith('/files/'):
+            self.send_file(int(self.path[len('/files/'):]))
+            return
+        body = server.page(self.path)
+        etag = '"%s"' % md5(body).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.respond(304, b'', etag=etag)
+            return
+        headers = {}
+        if server.gzip and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            headers['Content-Encoding'] = 'gzip'
+        status, offset, cut = self.select_range(len(body), headers)
+        self.respond(status, body[offset:], etag=etag, headers=headers,
+                     cut=cut)
+
+    do_HEAD = do_GET
+
+    def select_range(self, length, headers):
+        """ Apply a ``Range: bytes=N-`` header to a body of ``length``
+        bytes, returning the status and the offset to start at, and
+        decide where to cut off the response if the server is set to
+        fail transfers. """
+        status, offset = 200, 0
+        value = self.headers.get('Range', '')
+        if value.startswith('bytes=') and value.endswith('-'):
+            offset = int(value[6:-1])
+            if offset >= length:
+                headers['Content-Range'] = 'bytes */%d' % length
+                return 416, length, None
+            headers['Content-Range'] = 'bytes %d-%d/%d' % \
+                (offset, length - 1, length)
+            status = 206
+        cut = None
+        with self.server.lock:
+            if self.server.cut_after and self.server.cuts > 0:
+                self.server.cuts -= 1
+                cut = self.server.cut_after
+        return status, offset, cut
+
+    def send_file(self, size):
+        """ Stream a sparse file of ``size`` bytes, in chunks. """
+        headers = {'Accept-Ranges': 'bytes'}
+        status, offset, cut = self.select_range(size, headers)
+        length = size - offset
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(length))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        if cut is not None and cut < length:
+            length = cut
+            self.close_connection = True
+        with open(self.server.sparse_file(size), 'rb') as fh:
+            fh.seek(offset)
+            while length > 0:
+                chunk = fh.read(min(length, 1024 * 1024))
+                self.wfile.write(chunk)
+                length -= len(chunk)
+
+    def respond(self, status, body, etag=None, headers=None, cut=None):
+        if self.server.cache_headers:
+            self.send_response(status)
+        else:
+            self.log_request(status)
+            self.send_response_only(status)
+            self.send_header('Server', self.version_string())
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if status < 500 and self.server.cache_headers:
+            self.send_header('Cache-Control', 'max-age=3600')
+            self.send_header('Date', self.date_time_string())
+            self.send_header('ETag', etag)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        if cut is not None and cut < len(body):
+            # send a part of the body, then drop the connection.
+            self.wfile.write(body[:cut])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    """ Serve pages of ``size`` bytes after ``latency`` seconds, failing
+    a share of ``error_rate`` requests. Set ``cut_after`` and ``cuts`` to
+    drop the connection after ``cut_after`` bytes of the body, in the
+    next ``cuts`` responses. Without ``cache_headers``, responses have
+    no ``Cache-Control``, ``Date`` or ``ETag`` headers. """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, latency=0.0, size=10000, error_rate=0.0, port=0,
+                 gzip=False, cache_headers=True):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', port),
+                                     StandInHandler)
+        self.latency = latency
+        self.size = size
+        self.error_rate = error_rate
+        self.gzip = gzip
+        self.cache_headers = cache_headers
+        self.cut_after = None
+        self.cuts = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.files_path = tempfile.mkdtemp(prefix='standin-')
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def page(self, path):
+        text = '<p>%s: lorem ipsum dolor sit amet</p>\n' % path
+        head = '<html><head><title>%s</title></head><body>\n' % path
+        repeat = max(1, (self.size - len(head)) // len(text))
+        return (head + text * repeat + '</body></html>').encode('utf-8')
+
+    def sparse_file(self, size):
+        """ Get the path of a sparse file of ``size`` bytes, creating it
+        if needed. """
+        path = os.path.join(self.files_path, '%d.bin' % size)
+        with self.lock:
+            if not os.path.exists(path):
+                with open(path, 'wb') as fh:
+                    fh.truncate(size)
+        return path
+
+    def server_close(self):
+        ThreadingHTTPServer.server_close(self)
+        shutil.rmtree(self.files_path, ignore_errors=True)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--size', type=int, default=10000)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+    server = StandInServer(latency=args.latency, size=args.size,
+                           error_rate=args.error_rate, port=args.port)
+    print('Serving on %s' % server.url)
+    server.serve_forever()
@@ -0,0 +1,211 @@
+"""
+This module holds an ``asyncio``-based alternative to the thread pool
+in :py:mod:`scrapekit.tasks`. Tasks are executed as coroutines on a
+single event loop, so that a large number of them can be in flight at
+the same time without spawning an operating system thread for each.
+
+Task functions can be coroutine functions (or asynchronous generators,
+when used in a pipe). Plain functions are still supported, they will be
+run in a thread pool. HTTP requests made through ``scraper.aio`` are
+handed to the same thread pool, so that they use the same (cached)
+sessions as the threaded engine.
+
+The module requires Python 3.7 or later and is only loaded when the
+``engine`` setting is set to ``asyncio``.
+"""
+import asyncio
+import inspect
+import threading
+import contextvars
+from itertools import count
+from functools import partial
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from scrapekit.tasks import PipeListener
+from scrapekit.metrics import Metrics
+from scrapekit.scheduler import SeenSet
+
+
+class AsyncTaskManager(object):
+    """ A drop-in replacement for the
+    :py:class:`TaskManager <scrapekit.tasks.TaskManager>` which runs
+    queued tasks on an event loop. """
+
+    def __init__(self, concurrency=100, threads=10, dedup_size=1000000,
+                 metrics=None):
+        """
+        :param concurrency: The number of tasks which can be executed
+            at the same time.
+        :param threads: The number of threads used to run blocking code,
+            i.e. HTTP requests and tasks which are not coroutines.
+        :param dedup_size: The number of task keys to remember for
+            tasks which skip duplicate calls.
+        :param metrics: A :py:class:`Metrics <scrapekit.metrics.Metrics>`
+            instance to record queue statistics in.
+        """
+        self.concurrency = int(concurrency)
+        self.num_threads = int(threads)
+        self.seen = SeenSet(dedup_size)
+        self.metrics = metrics or Metrics()
+        self.counter = count()
+        self.loop = None
+        self.queue = None
+        self._executor = None
+        self._pending = []
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.num_threads)
+        return self._executor
+
+    def _on_loop(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def put(self, task, args, kwargs):
+        """ Add a new item to the queue. This can be called both from
+        coroutines on the event loop and from other threads.
+
+        Do not call this directly, use Task.queue/Task.run instead.
+        """
+        if task.dedup and not self.seen.add(task.key(args, kwargs)):
+            self.metrics.incr('queue.dedup_hits', label=task.name)
+            return
+        item = (-task.priority, next(self.counter), (task, args, kwargs))
+        with self._lock:
+            if self.loop is None:
+                self._pending.append(item)
+                return
+            loop = self.loop
+        if self._on_loop():
+            self.queue.put_nowait(item)
+        else:
+            loop.call_soon_threadsafe(self.queue.put_nowait, item)
+
+    def feed(self, task, iterable, ctx):
+        """ Queue the task for each item in an iterable. The queue of
+        the event loop is not bounded, so this can be done eagerly. """
+        for item in iterable:
+            self.put(task, (item,), {})
+
+    @property
+    def depth(self):
+        """ The number of tasks currently waiting in the queue. """
+        if self.queue is None:
+            return len(self._pending)
+        return self.queue.qsize() + len(self._pending)
+
+    @contextmanager
+    def blocking(self):
+        """ Blocking calls are made on the thread pool, which does not
+        need stand-in workers. """
+        yield
+
+    def wait(self):
+        """ Run the event loop until all queued tasks (and the tasks
+        queued by them) have been processed. """
+        if not self._pending:
+            return
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._main())
+        finally:
+            loop.close()
+
+    async def _main(self):
+        self.queue = asyncio.PriorityQueue()
+        with self._lock:
+            self.loop = asyncio.get_running_loop()
+            for item in self._pending:
+                self.queue.put_nowait(item)
+            self._pending = []
+
+        workers = [asyncio.ensure_future(self._consume())
+                   for i in range(self.concurrency)]
+        try:
+            await self.queue.join()
+        finally:
+            with self._lock:
+                self.loop = None
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _consume(self):
+        """ Main loop for each worker coroutine. """
+        while True:
+            task, args, kwargs = (await self.queue.get())[-1]
+            try:
+                await self._execute(task, args, kwargs)
+            finally:
+                self.queue.task_done()
+
+    async def _execute(self, task, args, kwargs):
+        if not (inspect.iscoroutinefunction(task.fn) or
+                inspect.isasyncgenfunction(task.fn)):
+            fn = partial(task, *args, **kwargs)
+            return await self.loop.run_in_executor(self.executor, fn)
+
+        # coroutines take turns on the thread of the event loop, so the
+        # samples of the profiler cannot be attributed to them.
+        started, failed = task._begin(args, kwargs, profile=False), False
+        try:
+            value = task.fn(*args, **kwargs)
+            if inspect.isawaitable(value):
+                value = await value
+            await self._notify(task, value)
+            return value
+        except Exception as e:
+            failed = True
+            task.scraper.log.exception(e)
+        finally:
+            task._end(started, failed, profile=False)
+
+    async def _notify(self, task, value):
+        for listener in task._listeners:
+            if isinstance(listener, PipeListener) and \
+                    hasattr(value, '__aiter__'):
+                async for value_item in value:
+                    listener.task.queue(value_item)
+            else:
+                listener.notify(value)
+
+
+class AsyncSession(object):
+    """ Awaitable versions of the HTTP helpers of a
+    :py:class:`Scraper <scrapekit.core.Scraper>`. Requests are executed
+    in a thread pool, using the per-thread sessions of the scraper, and
+    are subject to the same caching policies. """
+
+    def __init__(self, scraper):
+        self.scraper = scraper
+
+    async def request(self, method, url, **kwargs):
+        def send():
+            return self.scraper.session.request(method, url, **kwargs)
+        executor = getattr(self.scraper.task_manager, 'executor', None)
+        ctx = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, ctx.run, send)
+
+    def head(self, url, **kwargs):
+        """ Awaitable HTTP HEAD. """
+        kwargs.setdefault('allow_redirects', False)
+        return self.request('HEAD', url, **kwargs)
+
+    def get(self, url, **kwargs):
+        """ Awaitable HTTP GET. """
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        """ Awaitable HTTP POST. """
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        """ Awaitable HTTP PUT. """
+        return self.request('PUT', url, **kwargs)
@@ -0,0 +1,370 @@
+"""
+Storage backends for the HTTP response cache. Besides the one-file-per-
+URL ``FileCache`` shipped with CacheControl, responses can be kept in a
+single SQLite database, which avoids running out of inodes and keeps
+lookups cheap when millions of pages are cached.
+
+Cached bodies are compressed, and the total size of the cache can be
+bounded, in which case the oldest entries are removed by a background
+thread. Responses which are used often can also be kept in memory,
+already decompressed, in front of the cache on disk.
+"""
+import io
+import os
+import json
+import zlib
+import time
+import struct
+import sqlite3
+from threading import Thread, Lock, local
+from collections import OrderedDict
+
+from requests.structures import CaseInsensitiveDict
+from cachecontrol.cache import BaseCache
+from cachecontrol.caches import FileCache
+from cachecontrol.serialize import Serializer
+
+from scrapekit.exc import DependencyException
+
+
+FORMAT_PREFIX = b'sk=1,'
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/xml',
+                      'application/javascript', 'application/xhtml',
+                      '+xml', '+json')
+
+
+class CompressingSerializer(Serializer):
+    """ Serialize cached responses with a compressed body. Compression
+    is only applied to textual content types which have not already
+    been compressed by the server. Entries written by the default
+    serializer can still be read.
+
+    Each entry also records when it was stored, which is when the
+    response was fetched or last revalidated. Loaded responses carry
+    this time as their ``fetched`` attribute. """
+
+    def __init__(self, metrics, codec='zlib'):
+        self.metrics = metrics
+        self.codec = codec.lower().strip()
+        if self.codec == 'zstd':
+            try:
+                import zstandard
+                self.zstd = zstandard
+            except ImportError as ie:
+                raise DependencyException(ImportError(
+                    'The zstd cache compression requires the zstandard '
+                    'package, install it with: pip install scrapekit[zstd] '
+                    '(%s)' % ie))
+
+    def _codec_for(self, headers):
+        content_type = headers.get('content-type', '').lower()
+        if headers.get('content-encoding', 'identity') != 'identity':
+            return 'none'
+        for prefix in COMPRESSIBLE_TYPES:
+            if prefix in content_type:
+                return self.codec
+        return 'none'
+
+    def compress(self, codec, body):
+        if codec == 'zlib':
+            return zlib.compress(body)
+        if codec == 'zstd':
+            return self.zstd.ZstdCompressor().compress(body)
+        return body
+
+    def decompress(self, codec, body):
+        if codec == 'zlib':
+            return zlib.decompress(body)
+        if codec == 'zstd':
+            return self.zstd.ZstdDecompressor().decompress(body)
+        return body
+
+    def dumps(self, request, response, body=None):
+        headers = CaseInsensitiveDict(response.headers)
+        if body is None:
+            body = response.read(decode_content=False)
+            response._fp = io.BytesIO(body)
+
+        vary = {}
+        for header in headers.get('vary', '').split(','):
+            header = header.strip()
+            if len(header):
+                vary[header] = request.headers.get(header, None)
+
+        codec = self._codec_for(headers)
+        stored = self.compress(codec, body)
+        if len(stored) >= len(body):
+            codec, stored = 'none', body
+        self.metrics.incr('cache.bytes_saved', len(body) - len(stored))
+
+        cached = {
+            'codec': codec,
+            'fetched': time.time(),
+            'vary': vary,
+            'response': {
+                'headers': dict(response.headers.items()),
+                'status': response.status,
+                'version': response.version,
+                'reason': response.reason,
+                'decode_content': response.decode_content
+            }
+        }
+        if hasattr(response, 'strict'):
+            cached['response']['strict'] = response.strict
+        meta = json.dumps(cached).encode('utf-8')
+        return FORMAT_PREFIX + struct.pack('>I', len(meta)) + meta + stored
+
+    def decode(self, data):
+        """ Turn a stored entry into the dict used to build a response,
+        or return ``None`` if it is not in the format of this class. """
+        if not data or not data.startswith(FORMAT_PREFIX):
+            return None
+        offset = len(FORMAT_PREFIX)
+        length, = struct.unpack('>I', data[offset:offset + 4])
+        offset += 4
+        try:
+            cached = json.loads(data[offset:offset + length].decode('utf-8'))
+            body = self.decompress(cached.pop('codec'),
+                                   data[offset + length:])
+        except (ValueError, zlib.error):
+            return None
+        cached['response']['body'] = body
+        return DecodedEntry(cached, len(body) + length)
+
+    def loads(self, request, data):
+        if isinstance(data, DecodedEntry):
+            # prepare_response modifies the dict it is given.
+            cached = dict(data.cached)
+            cached['response'] = dict(cached['response'])
+            response = self.prepare_response(request, cached)
+            if response is not None:
+                response.fetched = cached.get('fetched')
+            return response
+        if not data or not data.startswith(FORMAT_PREFIX):
+            return super(CompressingSerializer, self).loads(request, data)
+        entry = self.decode(data)
+        if entry is not None:
+            return self.loads(request, entry)
+
+
+class DecodedEntry(object):
+    """ A cache entry which has been decompressed and parsed. """
+    __slots__ = ('cached', 'size')
+
+    def __init__(self, cached, size):
+        self.cached = cached
+        self.size = size
+
+
+class MemoryCache(BaseCache):
+    """ Keep the most recently used entries of another cache in memory,
+    up to a total of ``max_size`` bytes. Entries are kept decoded, so
+    that a hit needs neither disk access nor decompression. The cache is
+    shared by the sessions of all worker threads. """
+
+    def __init__(self, cache, serializer, max_size, metrics):
+        self.cache = cache
+        self.serializer = serializer
+        self.max_size = max_size
+        self.metrics = metrics
+        self.entries = OrderedDict()
+        self.size = 0
+        # incremented on each change, to notice writes which happen
+        # while an entry is being read from the other cache.
+        self.version = 0
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+                self.metrics.incr('cache.memory_hits')
+                return entry
+            version = self.version
+        self.metrics.incr('cache.memory_misses')
+        data = self.cache.get(key)
+        entry = self.serializer.decode(data)
+        if entry is None:
+            return data
+        if entry.size > self.max_size:
+            return entry
+        with self.lock:
+            if version == self.version and key not in self.entries:
+                self.entries[key] = entry
+                self.size += entry.size
+                self._shrink()
+        return entry
+
+    def _shrink(self):
+        while self.size > self.max_size:
+            key, entry = self.entries.popitem(last=False)
+            self.size -= entry.size
+            self.metrics.incr('cache.memory_evictions')
+
+    def _forget(self, key):
+        with self.lock:
+            self.version += 1
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry.size
+
+    def set(self, key, value):
+        self._forget(key)
+        self.cache.set(key, value)
+
+    def delete(self, key):
+        self._forget(key)
+        self.cache.delete(key)
+
+    def evict(self, max_size):
+        return self.cache.evict(max_size)
+
+    def close(self):
+        self.cache.close()
+
+
+class SQLiteCache(BaseCache):
+    """ A cache stored in a single SQLite database file. The database
+    is used in WAL mode, so that readers do not wait for writers, and
+    each thread uses its own connection. """
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+        self.local = local()
+        conn = self.conn
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS cache (
+            key TEXT PRIMARY KEY, value BLOB, size INTEGER,
+            created REAL)""")
+        conn.execute("""CREATE INDEX IF NOT EXISTS cache_created
+            ON cache (created)""")
+
+    @property
+    def conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self.conn.execute("SELECT value FROM cache WHERE key = ?",
+                                (key,)).fetchone()
+        if row is not None:
+            return bytes(row[0])
+
+    def set(self, key, value):
+        self.conn.execute("INSERT OR REPLACE INTO cache (key, value, size, "
+                          "created) VALUES (?, ?, ?, ?)",
+                          (key, sqlite3.Binary(value), len(value), time.time()))
+
+    def delete(self, key):
+        self.conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def evict(self, max_size):
+        """ Delete the oldest entries until the cache is no larger than
+        ``max_size`` bytes. Returns the number of deleted entries. """
+        total = self.conn.execute("SELECT SUM(size) FROM cache").fetchone()
+        excess = (total[0] or 0) - max_size
+        if excess <= 0:
+            return 0
+        keys = []
+        rows = self.conn.execute("SELECT key, size FROM cache "
+                                 "ORDER BY created")
+        for key, size in rows:
+            if excess <= 0:
+                break
+            keys.append((key,))
+            excess -= size
+        rows.close()
+        self.conn.executemany("DELETE FROM cache WHERE key = ?", keys)
+        return len(keys)
+
+    def close(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self.local.conn = None
+
+
+class DirectoryCache(FileCache):
+    """ The CacheControl ``FileCache``, with support for eviction. """
+
+    def evict(self, max_size):
+        """ Delete the oldest files until the cache is no larger than
+        ``max_size`` bytes. Returns the number of deleted entries. """
+        entries, total = [], 0
+        for (dir_path, dir_names, file_names) in os.walk(self.directory):
+            for file_name in file_names:
+                path = os.path.join(dir_path, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        evicted = 0
+        for (mtime, size, path) in sorted(entries):
+            if total <= max_size:
+                break
+            try:
+                os.remove(path)
+                evicted += 1
+            except OSError:
+                pass
+            total -= size
+        return evicted
+
+
+class CacheJanitor(Thread):
+    """ A background thread which periodically evicts old entries from
+    the cache, to keep it within its maximum size. """
+
+    def __init__(self, cache, max_size, metrics, interval=60):
+        super(CacheJanitor, self).__init__()
+        self.daemon = True
+        self.cache = cache
+        self.max_size = max_size
+        self.metrics = metrics
+        self.interval = interval
+
+    def run(self):
+        while True:
+            evicted = self.cache.evict(self.max_size)
+            self.metrics.incr('cache.evictions', evicted)
+            time.sleep(self.interval)
+
+
+def make_cache(scraper):
+    """ Create the response cache configured for the scraper, and
+    start evicting old entries if its size is limited. If the
+    ``cache_memory`` setting is given, recently used entries are also
+    kept in memory. """
+    backend = scraper.config.cache_backend
+    cache_path = os.path.join(scraper.config.data_path, 'cache')
+    if backend == 'file':
+        cache = DirectoryCache(cache_path)
+    elif backend == 'sqlite':
+        cache = SQLiteCache(cache_path + '.sqlite')
+    else:
+        raise ValueError('Unknown cache backend: %r' % backend)
+
+    max_size = int(scraper.config.cache_max_size)
+    if max_size > 0:
+        CacheJanitor(cache, max_size, scraper.metrics).start()
+    memory_size = int(scraper.config.cache_memory)
+    if memory_size > 0:
+        cache = MemoryCache(cache, make_serializer(scraper), memory_size,
+                            scraper.metrics)
+    return cache
+
+
+def make_serializer(scraper):
+    """ Create the serializer used to store responses in the cache. """
+    return CompressingSerializer(scraper.metrics,
+                                 codec=scraper.config.cache_compression)
@@ -6,6 +6,20 @@ except ImportError:
     from configparser import ConfigParser as SafeConfigParser
 
 
+def as_bool(value):
+    """ Interpret a setting (which may be given as a string in the
+    configuration file or an environment variable) as a boolean. """
+    if hasattr(value, 'strip'):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+# settings which are interpreted as booleans, and as names of options.
+BOOLEAN_SETTINGS = ('dedup', 'profile', 'journal')
+CHOICE_SETTINGS = ('engine', 'cache_backend', 'queue_backend', 'log_format',
+                   'log_overflow')
+
+
 class Config(object):
     """ An object to load and represent the configuration of the current
     scraper. This loads scraper configuration from the environment and a
@@ -18,14 +32,46 @@ class Config(object):
         self.config = self._get_env(self.config)
         if config is not None:
             self.config.update(config)
+        self._normalize(self.config)
 
     def _get_defaults(self):
         name = self.scraper.name
         return {
             'cache_policy': 'http',
+            'cache_backend': 'file',
+            'cache_compression': 'zlib',
+            'cache_max_size': 0,
+            'cache_memory': 0,
             'threads': multiprocessing.cpu_count() * 2,
+            'threads_max': 0,
+            'pool_size': 10,
+            'engine': 'threads',
+            'concurrency': 100,
+            'processes': multiprocessing.cpu_count(),
+            'rate_limit': 0,
+            'rate_burst': 1,
+            'host_concurrency': 0,
+            'dedup': False,
+            'dedup_size': 1000000,
             'data_path': os.path.join(os.getcwd(), 'data', name),
-            'reports_path': None
+            'reports_path': None,
+            'report_db': None,
+            'report_processes': 1,
+            'log_format': 'json',
+            'log_buffer': 10000,
+            'log_overflow': 'block',
+            'log_sample': 1,
+            'stats_port': 0,
+            'stats_file': None,
+            'stats_interval': 10,
+            'profile': False,
+            'profile_interval': 0.01,
+            'journal': False,
+            'journal_interval': 1,
+            'journal_snapshot': 100000,
+            'queue_backend': 'memory',
+            'queue_path': None,
+            'queue_timeout': 600
         }
 
     def _get_env(self, config):
@@ -38,6 +84,18 @@ class Config(object):
             config[option] = value
         return config
 
+    def _normalize(self, config):
+        """ Settings given in a file or the environment are strings, so
+        they are converted once here rather than wherever they are
+        used. """
+        for option in BOOLEAN_SETTINGS:
+            config[option] = as_bool(config.get(option))
+        for option in CHOICE_SETTINGS:
+            value = config.get(option)
+            if hasattr(value, 'strip'):
+                config[option] = value.strip().lower()
+        return config
+
     def _get_file(self, config):
         """ Read a per-user .ini file, which is expected to have either
         a ``[scraperkit]`` or a ``[$SCRAPER_NAME]`` section. """
@@ -5,9 +5,17 @@ from datetime import datetime
 from threading import local
 
 from scrapekit.config import Config
-from scrapekit.tasks import TaskManager, Task
-from scrapekit.http import make_session
+from scrapekit.tasks import TaskManager, TaskContext, Task
+from scrapekit.http import make_session, download, SingleFlight
+from scrapekit.cache import make_cache
+from scrapekit.throttle import make_throttle
+from scrapekit.metrics import Metrics
+from scrapekit.processes import ProcessPool
 from scrapekit.logs import make_logger
+from scrapekit.stats import collect, start_exporters
+from scrapekit.profiler import make_profiler
+from scrapekit.journal import make_journal
+from scrapekit.scheduler import make_queue_factory
 from scrapekit import reporting
 
 
@@ -25,27 +33,65 @@ class Scraper(object):
         except:
             pass
         self._task_manager = None
-        self.task_ctx = local()
+        self.tasks = {}
+        self._sessions = local()
+        self._aio = None
+        self.process_pool = ProcessPool(self, self.config.processes)
+        self.task_ctx = TaskContext()
+        self.metrics = Metrics()
         self.log = make_logger(self)
+        self.throttle = make_throttle(self)
+        self.cache = make_cache(self)
+        self.flights = SingleFlight()
+        self.profiler = make_profiler(self)
+        self.journal = make_journal(self)
+        # the exporters read the state set up above from their threads.
+        start_exporters(self)
 
-        self.session = self.Session()
         if report:
             atexit.register(self.report)
 
     @property
     def task_manager(self):
         if self._task_manager is None:
-            self._task_manager = \
-                TaskManager(threads=self.config.threads)
+            if self.config.engine == 'asyncio':
+                from scrapekit.aio import AsyncTaskManager
+                self._task_manager = \
+                    AsyncTaskManager(concurrency=self.config.concurrency,
+                                     threads=self.config.threads,
+                                     dedup_size=self.config.dedup_size,
+                                     metrics=self.metrics)
+            else:
+                self._task_manager = \
+                    TaskManager(threads=self.config.threads,
+                                dedup_size=self.config.dedup_size,
+                                metrics=self.metrics,
+                                max_threads=self.config.threads_max,
+                                journal=self.journal,
+                                queue_factory=make_queue_factory(self))
+            if any(t.executor == 'process' for t in self.tasks.values()):
+                # fork before any worker threads are running.
+                self.process_pool.start()
         return self._task_manager
 
-    def task(self, fn):
+    def task(self, fn=None, **kwargs):
         """ Decorate a function as a task in the scraper framework.
         This will enable the function to be queued and executed in
         a separate thread, allowing for the execution of the scraper
         to be asynchronous.
+
+        The decorator can also be given options for the
+        :py:class:`Task <scrapekit.tasks.Task>`::
+
+            @scraper.task(priority=10, dedup=True)
+            def scrape_page(url):
+                pass
         """
-        return Task(self, fn)
+        if fn is None:
+            return lambda fn: self.task(fn, **kwargs)
+        task = Task(self, fn, **kwargs)
+        self.tasks[task.name] = task
+        return task
 
     def Session(self):
         """ Create a pre-configured ``requests`` session instance
@@ -54,39 +100,90 @@ class Scraper(object):
         configuration of the scraper. """
         return make_session(self)
 
+    @property
+    def session(self):
+        """ A long-lived session bound to the current thread. Each
+        worker thread re-uses its own session (and the connection
+        pool within it), so that consecutive requests to the same host
+        can be made over a kept-alive connection. """
+        session = getattr(self._sessions, 'session', None)
+        if session is None:
+            session = self.Session()
+            self._sessions.session = session
+        return session
+
+    @property
+    def aio(self):
+        """ Awaitable versions of the HTTP helpers (``get``, ``post``,
+        ``put`` and ``head``), for use in coroutine tasks run by the
+        ``asyncio`` engine::
+
+            res = await scraper.aio.get(url)
+        """
+        if self._aio is None:
+            from scrapekit.aio import AsyncSession
+            self._aio = AsyncSession(self)
+        return self._aio
+
     def head(self, url, **kwargs):
         """ HTTP HEAD via ``requests``.
 
         See: http://docs.python-requests.org/en/latest/api/#requests.head
         """
-        return self.Session().get(url, **kwargs)
+        return self.session.head(url, **kwargs)
 
     def get(self, url, **kwargs):
         """ HTTP GET via ``requests``.
 
         See: http://docs.python-requests.org/en/latest/api/#requests.get
         """
-        return self.Session().get(url, **kwargs)
+        return self.session.get(url, **kwargs)
 
     def post(self, url, **kwargs):
         """ HTTP POST via ``requests``.
 
         See: http://docs.python-requests.org/en/latest/api/#requests.post
         """
-        return self.Session().post(url, **kwargs)
+        return self.session.post(url, **kwargs)
 
     def put(self, url, **kwargs):
         """ HTTP PUT via ``requests``.
 
         See: http://docs.python-requests.org/en/latest/api/#requests.put
         """
-        return self.Session().put(url, **kwargs)
+        return self.session.put(url, **kwargs)
+
+    def download(self, url, path, **kwargs):
+        """ Download a (potentially very large) file to ``path``,
+        without holding it in memory or storing it in the cache.
+        Interrupted transfers are resumed, and the size and checksum of
+        the file can be verified. Returns the path, so that it can be
+        passed on to the next task in a pipeline.
+
+        See: :py:func:`scrapekit.http.download`
+        """
+        return download(self.session, url, path, **kwargs)
+
+    def stats(self):
+        """ Get statistics about the current run of the scraper, such
+        as the number, rate and duration of calls for each task, the
+        length of the queue, HTTP status codes and the cache hit ratio.
+
+        See: :py:mod:`scrapekit.stats`
+        """
+        return collect(self)
 
     def report(self):
         """ Generate a static HTML report for the last runs of the
         scraper from its log file. """
+        self.log.flush()
+        if self.profiler is not None:
+            self.profiler.write()
         index_file = reporting.generate(self)
-        print("Report available at: file://%s" % index_file)
+        if index_file is None:
+            print("No runs to report on yet.")
+        else:
+            print("Report available at: file://%s" % index_file)
 
     def __repr__(self):
         return '<Scraper(%s)>' % self.name
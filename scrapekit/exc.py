@@ -25,3 +25,8 @@ class DependencyException(ScraperException, WrappedMixIn):
 class ParseException(ScraperException, WrappedMixIn):
     """ Triggered when parsing an HTTP response into the desired
     format (e.g. an HTML DOM, or JSON) is not possible. """
+
+
+class DownloadException(ScraperException):
+    """ Triggered when a downloaded file does not match its expected
+    size or checksum. """
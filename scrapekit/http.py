@@ -1,14 +1,55 @@
 import os
+import copy
+import hashlib
+from time import time
+from threading import Lock, Event
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.exceptions import HTTPError as \
+    TransportError
 from cachecontrol.adapter import CacheControlAdapter
-from cachecontrol.caches import FileCache
 from cachecontrol.controller import CacheController
 
 from scrapekit.exc import DependencyException, ParseException
+from scrapekit.exc import DownloadException
+from scrapekit.cache import make_serializer
 
 
 CARRIER_HEADER = 'X-Scrapekit-Cache-Policy'
+CACHING_POLICIES = ('http', 'force', 'revalidate')
+MAX_AGE_PREFIX = 'max-age='
+COALESCED_METHODS = ('GET', 'HEAD')
+
+
+def is_caching(cache_policy):
+    """ Check if a cache policy routes requests through the cache. """
+    return cache_policy in CACHING_POLICIES or \
+        str(cache_policy).startswith(MAX_AGE_PREFIX)
+
+
+def max_age(cache_policy):
+    """ Get the number of seconds in a ``max-age=N`` policy, or
+    ``None`` for other policies. """
+    if not str(cache_policy).startswith(MAX_AGE_PREFIX):
+        return None
+    try:
+        return int(cache_policy[len(MAX_AGE_PREFIX):])
+    except ValueError:
+        raise ValueError('Invalid cache policy: %r' % cache_policy)
+
+
+def cached_age(response):
+    """ Seconds since a cached response was fetched or last revalidated,
+    or ``None`` if the cache entry does not record this. """
+    fetched = getattr(response, 'fetched', None)
+    if fetched is None:
+        return None
+    return time() - fetched
 
 
 class ScraperResponse(requests.Response):
@@ -45,6 +86,42 @@ class ScraperResponse(requests.Response):
             raise ParseException(ve)
 
 
+class Flight(object):
+    """ A request which is in progress, and which other threads making
+    the same request can wait for. """
+
+    def __init__(self):
+        self.event = Event()
+        self.response = None
+
+
+class SingleFlight(object):
+    """ Keeps track of the requests in progress in all sessions of a
+    scraper, so that identical requests made at the same time can be
+    coalesced into one. """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.flights = {}
+
+    def join(self, key):
+        """ Get the flight for ``key``, and whether the caller has to
+        make the request (it is the first to ask for it). """
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self.flights[key] = Flight()
+            return flight, True
+
+    def land(self, key, flight, response):
+        """ Share the response of a flight with those waiting for it. """
+        with self.lock:
+            del self.flights[key]
+        flight.response = response
+        flight.event.set()
+
+
 class ScraperSession(requests.Session):
     """ Sub-class requests session to be able to introduce additional
     state to sessions and responses. """
@@ -52,13 +129,49 @@ class ScraperSession(requests.Session):
     def request(self, method, url, cache=None, **kwargs):
         # decide the cache policy and place it in a fake HTTP header
         cache_policy = cache or self.cache_policy
-        if 'headers' not in kwargs:
-            kwargs['headers'] = {}
+        if cache_policy is True:
+            cache_policy = 'force'
+        kwargs['headers'] = dict(kwargs.get('headers') or {})
         kwargs['headers'][CARRIER_HEADER] = cache_policy
 
         # TODO: put UA fakery here.
 
-        orig = super(ScraperSession, self).request(method, url, **kwargs)
+        # Identical cacheable GET (or HEAD) requests made while one of
+        # them is in progress wait for it and get a copy of its response.
+        # Streamed responses cannot be shared, as they are read once.
+        method = method.upper()
+        if method not in COALESCED_METHODS or not is_caching(cache_policy) \
+                or kwargs.get('stream'):
+            return self._request(method, url, cache_policy, kwargs)
+        key = (method, url, repr(sorted(kwargs.items())))
+        flights = self.scraper.flights
+        flight, leader = flights.join(key)
+        if not leader:
+            with self.scraper.task_manager.blocking():
+                flight.event.wait()
+            if flight.response is not None:
+                host = urlparse(url).netloc.lower()
+                self.scraper.metrics.incr('http.coalesced', label=host)
+                return _copy_response(flight.response)
+            # the request failed, so try again.
+            return self._request(method, url, cache_policy, kwargs)
+        response = None
+        try:
+            response = self._request(method, url, cache_policy, kwargs)
+            # read the body, so that the response can be copied.
+            response.content
+            return response
+        finally:
+            flights.land(key, flight, response)
+
+    def _request(self, method, url, cache_policy, kwargs):
+        with self.scraper.throttle.limit(url,
+                                         self.scraper.task_manager.blocking):
+            started = time()
+            response = super(ScraperSession, self).request(method, url,
+                                                           **kwargs)
+        self._record(response, cache_policy, time() - started,
+                     kwargs.get('stream', False))
 
         # log request details to the JSON log
         self.scraper.log.debug("%s %s", method, url, extra={
@@ -68,44 +181,230 @@ class ScraperSession(requests.Session):
             })
 
         # Cast the response into our own subclass which has HTML/XML
-        # parsing support.
-        response = ScraperResponse()
-        response.__setstate__(orig.__getstate__())
+        # parsing support. Only the class is swapped, so that the body
+        # is not read (which would break streaming).
+        response.__class__ = ScraperResponse
         return response
 
+    def _record(self, response, cache_policy, duration, stream=False):
+        """ Count the request in the scraper metrics. """
+        metrics = self.scraper.metrics
+        host = urlparse(response.url).netloc.lower()
+        metrics.incr('http.requests', label=host)
+        metrics.incr('http.status', label=response.status_code)
+        metrics.observe('http.duration', duration, label=host)
+        if is_caching(cache_policy):
+            if getattr(response, 'from_cache', False):
+                metrics.incr('cache.hits', label=host)
+                size = _body_size(response, stream)
+                metrics.incr('cache.bytes_avoided', size, label=cache_policy)
+                if not getattr(response, 'revalidated', False):
+                    metrics.incr('cache.requests_avoided', label=cache_policy)
+            else:
+                metrics.incr('cache.misses', label=host)
+
+
+class PolicyCacheAdapter(CacheControlAdapter):
+    """ Route requests through the cache only if their caching policy
+    calls for it. Other requests go straight to the network, which
+    also avoids buffering the response body in memory so it can be
+    stored in the cache. """
+
+    def send(self, request, **kwargs):
+        request.cache_policy = request.headers.pop(CARRIER_HEADER, 'none')
+        if not is_caching(request.cache_policy):
+            return HTTPAdapter.send(self, request, **kwargs)
+        return super(PolicyCacheAdapter, self).send(request, **kwargs)
+
+    def build_response(self, request, response, from_cache=False):
+        if not is_caching(getattr(request, 'cache_policy', None)):
+            resp = HTTPAdapter.build_response(self, request, response)
+            resp.from_cache = False
+            return resp
+        # a 304 means the cached copy is still valid.
+        revalidated = not from_cache and response.status == 304
+        resp = super(PolicyCacheAdapter, self).build_response(
+            request, response, from_cache=from_cache)
+        resp.revalidated = revalidated and resp.from_cache
+        return resp
+
 
 class PolicyCacheController(CacheController):
     """ Switch the caching mode based on the caching policy provided by
     request, which in turn can be given at request time or through the
-    scraper configuration. """
+    scraper configuration.
+
+    With the ``revalidate`` and ``max-age=N`` policies, responses are
+    stored whatever their headers say. ``revalidate`` always asks the
+    server whether the stored response is still current, while
+    ``max-age=N`` uses it without asking while it is less than ``N``
+    seconds old. """
 
     def cached_request(self, request):
-        cache_policy = request.headers.pop(CARRIER_HEADER, 'none')
-        if cache_policy == 'force' or cache_policy is True:
+        cache_policy = getattr(request, 'cache_policy', 'none')
+        if cache_policy == 'force':
             # Force using the cache, even if HTTP semantics forbid it.
             cache_url = self.cache_url(request.url)
             resp = self.serializer.loads(request, self.cache.get(cache_url))
             return resp or False
         elif cache_policy == 'http':
             return super(PolicyCacheController, self).cached_request(request)
-        else:
-            return False
+        seconds = max_age(cache_policy)
+        if seconds is not None:
+            cache_url = self.cache_url(request.url)
+            resp = self.serializer.loads(request, self.cache.get(cache_url))
+            if resp:
+                age = cached_age(resp)
+                if age is not None and age < seconds:
+                    return resp
+        # for stale entries, the adapter adds conditional headers.
+        return False
+
+    def cache_response(self, request, response, body=None):
+        if max_age(getattr(request, 'cache_policy', None)) is None and \
+                getattr(request, 'cache_policy', None) != 'revalidate':
+            return super(PolicyCacheController, self).cache_response(
+                request, response, body=body)
+        if response.status not in (200, 203, 300, 301):
+            return
+        length = response.headers.get('content-length', '')
+        if body is not None and length.isdigit() and int(length) != len(body):
+            return
+        self.cache.set(self.cache_url(request.url),
+                       self.serializer.dumps(request, response, body=body))
+
+
+def _body_size(response, stream):
+    """ Get the size of a response body without reading it, where it
+    has not been read already. Streamed responses which do not give
+    their length are counted as empty. """
+    length = response.headers.get('content-length', '')
+    if length.isdigit():
+        return int(length)
+    if stream:
+        return 0
+    return len(response.content)
+
+
+def _copy_response(response):
+    """ Copy a response which has been read, for another caller. """
+    clone = copy.copy(response)
+    clone.headers = response.headers.copy()
+    clone.from_cache = getattr(response, 'from_cache', False)
+    return clone
+
+
+def _expected_size(response, offset):
+    """ Determine the full size of a file from the headers of a (partial)
+    response. """
+    content_range = response.headers.get('content-range', '')
+    if '/' in content_range:
+        total = content_range.rsplit('/', 1)[-1]
+        if total.isdigit():
+            return int(total)
+    length = response.headers.get('content-length', '')
+    if length.isdigit():
+        return int(length) + offset
+
+
+def _file_checksum(path, algorithm, chunk_size):
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def download(session, url, path, size=None, checksum=None, retries=3,
+             chunk_size=1024 * 1024, **kwargs):
+    """ Download ``url`` to the file ``path``, streaming the response
+    to disk in chunks. The data is written to ``path + '.part'`` first,
+    and if the transfer fails it is resumed using an HTTP Range request
+    (either in one of the ``retries``, or in a later call).
+
+    :param size: The expected size of the file. If not given, the size
+        announced by the server is checked, if any.
+    :param checksum: The expected checksum of the file, as a hex digest
+        prefixed by the name of the hash algorithm, e.g.
+        ``sha256:9f86d08...``.
+    """
+    part_path = path + '.part'
+    expected = None
+    for attempt in range(retries + 1):
+        offset = 0
+        if os.path.exists(part_path):
+            offset = os.path.getsize(part_path)
+        headers = dict(kwargs.get('headers') or {})
+        # sizes and offsets refer to the bytes as they are sent, so ask
+        # the server not to compress them on the fly.
+        headers.setdefault('Accept-Encoding', 'identity')
+        if offset > 0:
+            headers['Range'] = 'bytes=%d-' % offset
+        options = dict(kwargs, headers=headers, cache='none', stream=True)
+        response = None
+        try:
+            response = session.get(url, **options)
+            if response.status_code == 416 and offset > 0:
+                # the partial file was already complete.
+                break
+            response.raise_for_status()
+            if response.status_code != 206:
+                offset = 0
+            expected = _expected_size(response, offset)
+            with open(part_path, 'ab' if offset else 'wb') as fh:
+                # if the server compressed the body anyway, keep it that
+                # way, as the file would otherwise not match its size.
+                for chunk in response.raw.stream(chunk_size,
+                                                 decode_content=False):
+                    fh.write(chunk)
+            if expected is None or os.path.getsize(part_path) >= expected:
+                break
+            session.scraper.log.warning('Download of %s was cut short, '
+                                        'resuming', url)
+        except (requests.RequestException, TransportError, IOError) as exc:
+            if attempt == retries:
+                raise
+            session.scraper.log.warning('Download of %s failed, resuming: %r',
+                                        url, exc)
+        finally:
+            if response is not None:
+                response.close()
+
+    actual = os.path.getsize(part_path)
+    expected = size if size is not None else expected
+    if expected is not None and actual != int(expected):
+        if actual > int(expected):
+            os.unlink(part_path)
+        raise DownloadException('Size mismatch for %s: expected %s, got %s'
+                                % (url, expected, actual))
+    if checksum is not None:
+        algorithm, _, digest = checksum.partition(':')
+        actual = _file_checksum(part_path, algorithm, chunk_size)
+        if actual != digest.lower():
+            os.unlink(part_path)
+            raise DownloadException('Checksum mismatch for %s: expected %s,'
+                                    ' got %s' % (url, digest, actual))
+    os.rename(part_path, path)
+    return path
 
 
 def make_session(scraper):
     """ Instantiate a session with the desired configuration parameters,
     including the cache policy. """
-    cache_path = os.path.join(scraper.config.data_path, 'cache')
     cache_policy = scraper.config.cache_policy
     cache_policy = cache_policy.lower().strip()
+    pool_size = int(scraper.config.pool_size)
     session = ScraperSession()
     session.scraper = scraper
     session.cache_policy = cache_policy
 
-    adapter = CacheControlAdapter(
-        FileCache(cache_path),
+    adapter = PolicyCacheAdapter(
+        scraper.cache,
         cache_etags=True,
-        controller_class=PolicyCacheController
+        serializer=make_serializer(scraper),
+        controller_class=PolicyCacheController,
+        pool_connections=pool_size,
+        pool_maxsize=pool_size
     )
     session.mount('http://', adapter)
     session.mount('https://', adapter)
@@ -0,0 +1,258 @@
+"""
+A durable record of the work queued by a scraper, which allows a run
+that was interrupted (killed, or crashed) to be resumed. When the
+``journal`` setting is enabled, each call of a task that is queued, and
+each call that has completed, is appended to a log in the ``journal``
+directory of the ``data_path``. From time to time, the log is replaced
+by a snapshot of the calls which are still pending and the keys of
+those which have completed.
+
+When :py:meth:`Task.run <scrapekit.tasks.Task.run>` finds pending calls
+in the journal, it queues them again instead of starting from scratch.
+Tasks are found again by their name, so names must be unique within a
+scraper, and the arguments of queued calls must be picklable. Once a
+run has finished, the journal is cleared.
+
+A call which pipes its output into another task only counts as
+completed once all of its output has been queued.
+"""
+import os
+import time
+import atexit
+from threading import Thread, Lock
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from scrapekit.scheduler import SeenSet
+
+
+class PendingCall(object):
+    """ A queued call which is being executed. It is marked as done in
+    the journal once it has returned, and all feeders holding on to it
+    have been exhausted. """
+
+    def __init__(self, journal, key):
+        self.journal = journal
+        self.key = key
+        self.refs = 1
+        self.lock = Lock()
+
+    def hold(self):
+        with self.lock:
+            self.refs += 1
+
+    def release(self):
+        with self.lock:
+            self.refs -= 1
+            if self.refs > 0:
+                return
+        self.journal.done(self.key)
+
+
+class Journal(Thread):
+    """ Keeps the state of the queue in memory, and a background thread
+    which writes the changes to disk in batches, every ``interval``
+    seconds. After ``snapshot_size`` records have been written to the
+    log, it is compacted into a snapshot. """
+
+    def __init__(self, scraper, path, interval=1.0, snapshot_size=100000):
+        super(Journal, self).__init__()
+        self.daemon = True
+        self.scraper = scraper
+        self.path = path
+        self.interval = interval
+        self.snapshot_size = snapshot_size
+        self.log_path = os.path.join(path, 'journal.log')
+        self.snapshot_path = os.path.join(path, 'journal.snapshot')
+        # key -> [task name, args, kwargs, number of queued calls]
+        self.pending = {}
+        # hashes of the keys of completed calls, and of those which
+        # were completed or left pending by an earlier run.
+        self.completed = set()
+        self.previous = set()
+        self.buffer = []
+        self.records = 0
+        self.lock = Lock()
+        self.write_lock = Lock()
+        try:
+            os.makedirs(path)
+        except OSError:
+            pass
+        self.load()
+        self.previous = set(self.completed)
+        self.fh = open(self.log_path, 'ab')
+
+    def _apply(self, record):
+        if record[0] == 'put':
+            key, name, args, kwargs = record[1:]
+            entry = self.pending.get(key)
+            if entry is None:
+                self.pending[key] = [name, args, kwargs, 1]
+            else:
+                entry[3] += 1
+        else:
+            key = record[1]
+            entry = self.pending.get(key)
+            if entry is not None:
+                entry[3] -= 1
+                if entry[3] <= 0:
+                    del self.pending[key]
+            self.completed.add(SeenSet.hash(key))
+
+    def _read(self, path):
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as fh:
+            while True:
+                try:
+                    yield pickle.load(fh)
+                except EOFError:
+                    return
+                except Exception:
+                    # the last record may have been cut off by a crash.
+                    self.scraper.log.warning('Journal is truncated: %s',
+                                             path)
+                    return
+
+    def load(self):
+        """ Restore the state from the snapshot and the log. """
+        for record in self._read(self.snapshot_path):
+            if record[0] == 'completed':
+                self.completed.update(record[1])
+            else:
+                key, name, args, kwargs, count = record[1:]
+                self.pending[key] = [name, args, kwargs, count]
+        for record in self._read(self.log_path):
+            self._apply(record)
+            self.records += 1
+
+    def is_resumed(self, key):
+        """ Check if the call with the given key was completed by an
+        earlier run, or has been queued again by :py:meth:`resume`. In
+        either case, it should not be queued again, e.g. by a resumed
+        task which pipes its output into the task of the call. """
+        return SeenSet.hash(key) in self.previous
+
+    def queued(self, task, args, kwargs):
+        """ Record that a call of ``task`` has been queued. """
+        record = ('put', task.key(args, kwargs), task.name, args, kwargs)
+        with self.lock:
+            self._apply(record)
+            self.buffer.append(record)
+
+    def done(self, key):
+        """ Record that the call with the given key has completed. """
+        record = ('done', key)
+        with self.lock:
+            self._apply(record)
+            self.buffer.append(record)
+
+    def _dump(self, fh, record):
+        try:
+            data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+            fh.write(data)
+        except Exception as e:
+            self.scraper.metrics.incr('journal.errors')
+            self.scraper.log.warning('Cannot journal %r: %r',
+                                     record[1], e)
+
+    def flush(self):
+        """ Write the buffered records to the log, or write a snapshot
+        if the log has grown large enough. """
+        with self.write_lock:
+            with self.lock:
+                buffer, self.buffer = self.buffer, []
+                self.records += len(buffer)
+                snapshot = None
+                if self.records >= self.snapshot_size:
+                    # the snapshot includes the buffered records.
+                    snapshot = ([(k, tuple(e)) for (k, e)
+                                 in self.pending.items()],
+                                list(self.completed))
+                    self.records = 0
+            if snapshot is not None:
+                self._snapshot(*snapshot)
+            elif buffer:
+                for record in buffer:
+                    self._dump(self.fh, record)
+                self.fh.flush()
+                os.fsync(self.fh.fileno())
+            self.scraper.metrics.incr('journal.records', len(buffer))
+
+    def _snapshot(self, pending, completed):
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'wb') as fh:
+            self._dump(fh, ('completed', completed))
+            for key, (name, args, kwargs, count) in pending:
+                self._dump(fh, ('pending', key, name, args, kwargs, count))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.rename(tmp_path, self.snapshot_path)
+        self.fh.close()
+        self.fh = open(self.log_path, 'wb')
+        self.scraper.metrics.incr('journal.snapshots')
+
+    def run(self):
+        while True:
+            self.flush()
+            time.sleep(self.interval)
+
+    def resume(self):
+        """ Queue the calls which were pending when the last run
+        stopped. Returns ``False`` if there are none. """
+        with self.lock:
+            pending = [(k, tuple(e)) for (k, e) in self.pending.items()]
+        if not pending:
+            return False
+        with self.lock:
+            self.previous.update(SeenSet.hash(k) for (k, e) in pending)
+        manager = self.scraper.task_manager
+        self.scraper.log.info('Resuming %d pending calls', len(pending))
+        for key, (name, args, kwargs, count) in pending:
+            task = self.scraper.tasks.get(name)
+            if task is None:
+                self.scraper.log.warning('Cannot resume %s, no task '
+                                         'named %r', key, name)
+                continue
+            for i in range(count):
+                manager.restore(task, args, kwargs)
+        return True
+
+    def clear(self):
+        """ Forget all state, once a run has been completed. """
+        with self.write_lock:
+            with self.lock:
+                self.pending.clear()
+                self.completed.clear()
+                self.previous.clear()
+                self.buffer = []
+                self.records = 0
+            self.fh.close()
+            if os.path.exists(self.snapshot_path):
+                os.unlink(self.snapshot_path)
+            self.fh = open(self.log_path, 'wb')
+
+
+def make_journal(scraper):
+    """ Start journalling the task queue, if the ``journal`` setting is
+    enabled. """
+    if not scraper.config.journal:
+        return None
+    if scraper.config.engine != 'threads':
+        scraper.log.warning('The journal is only supported by the '
+                            'threads engine.')
+        return None
+    if scraper.config.queue_backend != 'memory':
+        # shared queues are kept on disk already.
+        scraper.log.warning('The journal is only used with the memory '
+                            'queue backend.')
+        return None
+    path = os.path.join(scraper.config.data_path, 'journal')
+    journal = Journal(scraper, path,
+                      interval=float(scraper.config.journal_interval),
+                      snapshot_size=int(scraper.config.journal_snapshot))
+    journal.start()
+    atexit.register(journal.flush)
+    return journal
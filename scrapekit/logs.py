@@ -1,5 +1,9 @@
 import os
+import copy
+import atexit
 import logging
+from itertools import count
+from logging.handlers import QueueHandler, QueueListener
 
 try:
     import jsonlogger
@@ -7,28 +11,142 @@ except ImportError:
     # python-json-logger version 0.1.0 has changed the import structure
     from pythonjsonlogger import jsonlogger
 
+try:
+    from queue import Queue, Full, Empty
+except ImportError:
+    from Queue import Queue, Full, Empty
+
+OVERFLOW_POLICIES = ('block', 'drop_new', 'drop_old')
+MISSING = object()
+
 
 class TaskAdapter(logging.LoggerAdapter):
     """ Enhance any log messages with extra information about the
-    current context of the scraper. """
+    current context of the scraper. The context of each task is built
+    once and then re-used for all of its messages.
+
+    If ``sample`` is larger than 1, only one in that many DEBUG
+    messages is logged; messages of other levels are always kept. """
+
+    MAX_CONTEXTS = 10000
 
-    def __init__(self, logger, scraper):
+    def __init__(self, logger, scraper, log_queue=None, sample=1):
         super(TaskAdapter, self).__init__(logger, {})
         self.scraper = scraper
+        self.log_queue = log_queue
+        self.sample = max(1, int(sample))
+        self._counter = count()
+        self._contexts = {}
+        self._base = {
+            'scraperName': scraper.name,
+            'scraperId': str(scraper.id),
+            'scraperStartTime': scraper.start_time.isoformat()
+        }
+
+    def flush(self):
+        """ Wait until all buffered records have been written. """
+        if self.log_queue is not None:
+            self.log_queue.join()
+
+    def log(self, level, msg, *args, **kwargs):
+        if self.sample > 1 and level < logging.INFO and \
+                next(self._counter) % self.sample:
+            return
+        super(TaskAdapter, self).log(level, msg, *args, **kwargs)
+
+    def context(self):
+        """ Get the fields added to messages of the current task. """
+        ctx = self.scraper.task_ctx
+        key = (getattr(ctx, 'name', MISSING), getattr(ctx, 'id', MISSING))
+        context = self._contexts.get(key)
+        if context is None:
+            context = dict(self._base)
+            if key[0] is not MISSING:
+                context['taskName'] = key[0]
+            if key[1] is not MISSING:
+                context['taskId'] = key[1]
+            if len(self._contexts) >= self.MAX_CONTEXTS:
+                self._contexts = {}
+            self._contexts[key] = context
+        return context
 
     def process(self, msg, kwargs):
-        extra = kwargs.get('extra', {})
-        extra['scraperName'] = self.scraper.name
-        extra['scraperId'] = self.scraper.id
-        if hasattr(self.scraper.task_ctx, 'name'):
-            extra['taskName'] = self.scraper.task_ctx.name
-        if hasattr(self.scraper.task_ctx, 'id'):
-            extra['taskId'] = self.scraper.task_ctx.id
-        extra['scraperStartTime'] = self.scraper.start_time
+        # The context is only read by the logging module, so the cached
+        # dict can be passed on as it is.
+        extra = kwargs.get('extra')
+        if extra:
+            extra = dict(extra)
+            extra.update(self.context())
+        else:
+            extra = self.context()
         kwargs['extra'] = extra
         return (msg, kwargs)
 
 
+class RecordQueueHandler(QueueHandler):
+    """ Hand log records to a queue, so that they can be written by a
+    :py:class:`QueueListener <logging.handlers.QueueListener>` in
+    another thread (or process), without blocking the caller on disk
+    I/O.
+
+    If the queue is bounded and full, the ``overflow`` policy decides
+    what happens: ``block`` waits for space, ``drop_new`` discards the
+    new record and ``drop_old`` discards the oldest buffered record.
+    Records of level ``WARNING`` and above are never discarded on
+    arrival, they wait for space instead. """
+
+    def __init__(self, queue, overflow='block', metrics=None):
+        super(RecordQueueHandler, self).__init__(queue)
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown log overflow policy: %r' % overflow)
+        self.overflow = overflow
+        self.metrics = metrics
+        self.formatter = logging.Formatter()
+
+    def prepare(self, record):
+        """ Render the message and traceback of the record, so that it
+        does not hold on to the arguments of the call. Unlike in the
+        default implementation, the traceback is kept separate from the
+        message, in ``exc_text``. """
+        message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatter.formatException(record.exc_info)
+        record = copy.copy(record)
+        record.message = record.msg = message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.overflow == 'block' or record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+            return
+        except Full:
+            pass
+        if self.overflow == 'drop_old':
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+                self.queue.put_nowait(record)
+            except (Empty, Full):
+                pass
+        if self.metrics is not None:
+            self.metrics.incr('log.dropped')
+
+
+def stop_listener(logger, queue_handler, listener):
+    """ Write all buffered records and stop the background thread. Its
+    handlers are attached to the logger directly, so that records
+    emitted while the interpreter shuts down are not lost. """
+    logger.removeHandler(queue_handler)
+    listener.stop()
+    for handler in listener.handlers:
+        logger.addHandler(handler)
+
+
 def make_json_format():
     supported_keys = ['asctime', 'created', 'filename', 'funcName',
                       'levelname', 'levelno', 'lineno', 'module',
@@ -39,16 +157,59 @@ def make_json_format():
     return ' '.join(log_format(supported_keys))
 
 
-def log_path(scraper):
-    """ Determine the file name for the JSON log. """
+LOG_EXTENSIONS = {
+    'json': 'jsonlog',
+    'msgpack': 'msglog'
+}
+
+
+def log_path(scraper, log_format='json'):
+    """ Determine the file name for the JSON (or compact) log. The
+    compact log is written to a separate file for each run of the
+    scraper, as its string table cannot be shared by several writers
+    (see :py:mod:`scrapekit.msglog`). """
+    name = scraper.name
+    if log_format == 'msgpack':
+        name = '%s.%s' % (scraper.name, scraper.id)
     return os.path.join(scraper.config.data_path,
-                        '%s.jsonlog' % scraper.name)
+                        '%s.%s' % (name, LOG_EXTENSIONS[log_format]))
+
+
+def msglog_paths(scraper):
+    """ Find the compact log files of all runs of the scraper, in the
+    order they were created. """
+    prefix = scraper.name + '.'
+    suffix = '.' + LOG_EXTENSIONS['msgpack']
+    paths = []
+    for file_name in os.listdir(scraper.config.data_path):
+        if file_name.startswith(prefix) and file_name.endswith(suffix):
+            path = os.path.join(scraper.config.data_path, file_name)
+            paths.append((os.path.getctime(path), path))
+    return [path for (_, path) in sorted(paths)]
+
+
+def make_log_handler(scraper):
+    """ Create the handler for the log used to generate reports, in the
+    format given by the ``log_format`` setting. """
+    log_format = scraper.config.log_format
+    if log_format == 'msgpack':
+        from scrapekit.msglog import MsgpackHandler
+        return MsgpackHandler(log_path(scraper, log_format))
+    if log_format != 'json':
+        raise ValueError('Unknown log format: %r' % log_format)
+    handler = logging.FileHandler(log_path(scraper))
+    handler.setFormatter(jsonlogger.JsonFormatter(make_json_format()))
+    return handler
 
 
 def make_logger(scraper):
     """ Create two log handlers, one to output info-level ouput to the
     console, the other to store all logging in a JSON file which will
-    later be used to generate reports. """
+    later be used to generate reports.
+
+    Unless the ``log_buffer`` setting is 0, both handlers are run by a
+    background thread, which receives the records through a queue of
+    that size. """
 
     logger = logging.getLogger('')
     logger.setLevel(logging.DEBUG)
@@ -56,19 +217,32 @@ def make_logger(scraper):
     requests_log = logging.getLogger("requests")
     requests_log.setLevel(logging.WARNING)
 
-    json_handler = logging.FileHandler(log_path(scraper))
-    json_handler.setLevel(logging.DEBUG)
-    json_formatter = jsonlogger.JsonFormatter(make_json_format())
-    json_handler.setFormatter(json_formatter)
-    logger.addHandler(json_handler)
+    log_handler = make_log_handler(scraper)
+    log_handler.setLevel(logging.DEBUG)
 
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
     fmt = '%(name)s [%(levelname)-8s]: %(message)s'
     formatter = logging.Formatter(fmt)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+
+    log_queue = None
+    buffer_size = int(scraper.config.log_buffer)
+    if buffer_size > 0:
+        log_queue = Queue(maxsize=buffer_size)
+        overflow = scraper.config.log_overflow
+        queue_handler = RecordQueueHandler(log_queue, overflow=overflow,
+                                           metrics=scraper.metrics)
+        logger.addHandler(queue_handler)
+        listener = QueueListener(log_queue, log_handler, console_handler,
+                                 respect_handler_level=True)
+        listener.start()
+        atexit.register(stop_listener, logger, queue_handler, listener)
+    else:
+        logger.addHandler(log_handler)
+        logger.addHandler(console_handler)
 
     logger = logging.getLogger(scraper.name)
-    logger = TaskAdapter(logger, scraper)
+    logger = TaskAdapter(logger, scraper, log_queue=log_queue,
+                         sample=scraper.config.log_sample)
     return logger
@@ -0,0 +1,113 @@
+from bisect import bisect_left
+from threading import Lock
+
+# Upper bounds of the histogram buckets, in seconds.
+BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+           0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+def split_name(name):
+    """ Split a metric name into the name and its label, if any:
+    ``throttle.waits[example.com]`` becomes ``('throttle.waits',
+    'example.com')``. """
+    if name.endswith(']') and '[' in name:
+        name, label = name[:-1].split('[', 1)
+        return name, label
+    return name, None
+
+
+class Histogram(object):
+    """ The distribution of a measured value (such as the duration of
+    a task), counted in fixed buckets. """
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """ Estimate a quantile, assuming the values are spread evenly
+        within each bucket. """
+        if self.count == 0:
+            return None
+        rank, seen = q * self.count, 0
+        for idx, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                low = self.buckets[idx - 1] if idx > 0 else 0.0
+                if idx == len(self.buckets):
+                    return low
+                high = self.buckets[idx]
+                return low + (high - low) * (rank - seen) / count
+            seen += count
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99)
+        }
+
+
+class Metrics(object):
+    """ A thread-safe collection of named counters and histograms, which
+    are used by the different parts of the scraper to record statistics
+    about the current run. Metrics which are kept per host or per task
+    use the name of the host or task as a label, e.g.
+    ``throttle.wait_time[example.com]``. """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._values = {}
+        self._histograms = {}
+
+    def incr(self, name, value=1, label=None):
+        """ Increment the counter ``name`` (and, if given, the labelled
+        counter ``name[label]``) by ``value``. """
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+            if label is not None:
+                name = '%s[%s]' % (name, label)
+                self._values[name] = self._values.get(name, 0) + value
+
+    def observe(self, name, value, label=None):
+        """ Add ``value`` to the histogram ``name`` (and, if given, the
+        labelled histogram ``name[label]``). """
+        with self._lock:
+            names = [name]
+            if label is not None:
+                names.append('%s[%s]' % (name, label))
+            for name in names:
+                histogram = self._histograms.get(name)
+                if histogram is None:
+                    histogram = self._histograms[name] = Histogram()
+                histogram.observe(value)
+
+    def get(self, name, default=0):
+        return self._values.get(name, default)
+
+    def items(self):
+        with self._lock:
+            return sorted(self._values.items())
+
+    def histograms(self):
+        """ Get copies of all histograms, sorted by name. """
+        with self._lock:
+            items = []
+            for name, histogram in sorted(self._histograms.items()):
+                copy = Histogram(histogram.buckets)
+                copy.counts = list(histogram.counts)
+                copy.count, copy.sum = histogram.count, histogram.sum
+                items.append((name, copy))
+            return items
+
+    def __repr__(self):
+        return '<Metrics(%s)>' % len(self._values)
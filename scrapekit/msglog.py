@@ -0,0 +1,209 @@
+"""
+A compact, binary alternative to the JSON log. Records are stored as
+length-prefixed ``msgpack`` frames, and repeated strings (such as the
+scraper ID, task names and URLs) are written only once and then
+referred to by number. This makes the log both smaller and cheaper to
+write than the JSON log; it is enabled with the ``log_format`` setting
+and requires the ``msgpack`` package.
+
+Each frame starts with a five-byte header, holding the length of the
+payload and the kind of the frame:
+
+* ``STRING`` frames add a string to the table of interned strings,
+  it receives the next free number.
+* ``RECORD`` frames hold a log record, as a map in which all keys and
+  some of the values are references to interned strings.
+* ``RESET`` frames clear the string table. One is written whenever the
+  log is opened, and when the table would grow beyond its maximum size.
+
+As the string table is kept by the writer, a file must only be written
+by one process. Each run of a scraper therefore writes its own file
+(see :py:func:`log_path <scrapekit.logs.log_path>`).
+"""
+import struct
+import logging
+from datetime import date
+
+from scrapekit.exc import DependencyException
+
+try:
+    import msgpack
+except ImportError as ie:
+    msgpack = None
+    IMPORT_ERROR = ie
+
+
+HEADER = struct.Struct('>IB')
+REF = struct.Struct('>I')
+STRING, RECORD, RESET = 0, 1, 2
+REF_TYPE = 1
+MAX_STRINGS = 100000
+
+# Fields which tend to have the same value for many records, and are
+# therefore stored in the string table.
+INTERNED_FIELDS = set(['name', 'levelname', 'pathname', 'filename',
+                       'module', 'funcName', 'threadName', 'processName',
+                       'scraperName', 'scraperId', 'scraperStartTime',
+                       'taskName', 'taskId', 'reqMethod', 'reqUrl'])
+
+# Attributes which every LogRecord has, only some of which are logged.
+RECORD_ATTRS = set(logging.makeLogRecord({}).__dict__.keys())
+RECORD_ATTRS.update(['message', 'asctime'])
+LOGGED_ATTRS = ['asctime', 'created', 'filename', 'funcName',
+                'levelname', 'levelno', 'lineno', 'module', 'msecs',
+                'message', 'name', 'pathname', 'process', 'processName',
+                'relativeCreated', 'thread', 'threadName']
+
+
+def _require():
+    if msgpack is None:
+        raise DependencyException(ImportError(
+            'The msgpack log format requires the msgpack package, '
+            'install it with: pip install scrapekit[msgpack] (%s)'
+            % IMPORT_ERROR))
+
+
+def _plain(value):
+    """ Convert values msgpack cannot handle, the same way the JSON
+    log does. """
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+class MsgpackHandler(logging.Handler):
+    """ Write log records to a file in the compact log format. """
+
+    def __init__(self, path, max_strings=MAX_STRINGS):
+        _require()
+        super(MsgpackHandler, self).__init__()
+        self.path = path
+        self.max_strings = max_strings
+        self.packer = msgpack.Packer(use_bin_type=True, default=_plain)
+        self.formatter = logging.Formatter()
+        self.strings = {}
+        self.stream = open(path, 'ab')
+        self._write(RESET, b'')
+
+    def _write(self, kind, payload):
+        self.stream.write(HEADER.pack(len(payload), kind))
+        self.stream.write(payload)
+
+    def _intern(self, value):
+        """ Return the number of a string and the reference used for
+        it in records, adding it to the string table if needed. """
+        entry = self.strings.get(value)
+        if entry is None:
+            ref = len(self.strings)
+            entry = (ref, msgpack.ExtType(REF_TYPE, REF.pack(ref)))
+            self.strings[value] = entry
+            self._write(STRING, self.packer.pack(value))
+        return entry
+
+    def fields(self, record):
+        """ Collect the fields of a record, like the JSON log does. """
+        record.message = record.getMessage()
+        record.asctime = self.formatter.formatTime(record)
+        fields = dict((k, getattr(record, k, None)) for k in LOGGED_ATTRS)
+        for key, value in record.__dict__.items():
+            if key not in RECORD_ATTRS and not key.startswith('_'):
+                fields[key] = value
+        if record.exc_info:
+            fields['exc_info'] = self.formatter.formatException(
+                record.exc_info)
+        elif record.exc_text:
+            fields['exc_info'] = record.exc_text
+        return fields
+
+    def emit(self, record):
+        try:
+            fields = self.fields(record)
+            if len(self.strings) + len(fields) * 2 > self.max_strings:
+                # start a new string table before the record, so that
+                # all of its references point into the same table.
+                self.strings = {}
+                self._write(RESET, b'')
+            data = {}
+            for key, value in fields.items():
+                if key in INTERNED_FIELDS and value is not None:
+                    if not isinstance(value, str):
+                        value = _plain(value)
+                    value = self._intern(value)[1]
+                data[self._intern(key)[0]] = value
+            self._write(RECORD, self.packer.pack(data))
+            self.stream.flush()
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self.acquire()
+        try:
+            if not self.stream.closed:
+                self.stream.close()
+        finally:
+            self.release()
+        super(MsgpackHandler, self).close()
+
+
+class MsgpackReader(object):
+    """ Read records from a compact log file. Reading can be resumed
+    at the offset returned with a record, as long as the position of
+    the last ``RESET`` frame before it (``start``) is given as well, so
+    that the string table can be restored. """
+
+    def __init__(self, path):
+        _require()
+        self.path = path
+        self.strings = []
+        self.start = 0
+
+    def _ext_hook(self, code, data):
+        if code == REF_TYPE:
+            return self.strings[REF.unpack(data)[0]]
+        return msgpack.ExtType(code, data)
+
+    def _frames(self, fh, offset):
+        """ Iterate over the complete frames after ``offset``. Frames
+        which are still being written are left for later. """
+        fh.seek(offset)
+        while True:
+            header = fh.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            length, kind = HEADER.unpack(header)
+            yield offset, kind, length
+            offset += HEADER.size + length
+            if fh.tell() != offset:
+                fh.seek(offset)
+
+    def read(self, offset=0, start=0):
+        """ Yield tuples of a record and the offset after it. """
+        with open(self.path, 'rb') as fh:
+            # restore the string table in use at the offset.
+            self.strings, self.start = [], start
+            for pos, kind, length in self._frames(fh, start):
+                if pos >= offset:
+                    break
+                if kind == RESET:
+                    self.strings, self.start = [], pos
+                elif kind == STRING:
+                    self.strings.append(msgpack.unpackb(fh.read(length),
+                                                        raw=False))
+
+            for pos, kind, length in self._frames(fh, offset):
+                payload = fh.read(length)
+                if len(payload) < length:
+                    return
+                end = pos + HEADER.size + length
+                if kind == RESET:
+                    self.strings, self.start = [], pos
+                elif kind == STRING:
+                    self.strings.append(msgpack.unpackb(payload, raw=False))
+                elif kind == RECORD:
+                    data = msgpack.unpackb(payload, raw=False,
+                                           strict_map_key=False,
+                                           ext_hook=self._ext_hook)
+                    record = {}
+                    for key, value in data.items():
+                        record[self.strings[key]] = value
+                    yield record, end
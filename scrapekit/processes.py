@@ -0,0 +1,137 @@
+"""
+Support for running selected tasks in a pool of worker processes, to
+allow CPU-bound work (such as parsing large documents) to proceed in
+parallel despite the GIL. Tasks opt into this with
+``@scraper.task(executor='process')``. The worker threads of the
+:py:class:`TaskManager <scrapekit.tasks.TaskManager>` remain in charge
+of queueing: they hand the call to a child process, wait for the result
+and notify the pipeline listeners as usual.
+
+The worker processes are forked once, from the main thread, when the
+task manager is first needed, so that they inherit the tasks which the
+scraper has defined by then. Tasks are found again by their name, which
+means they do not have to be defined at the top level of a module.
+
+Log records emitted in the child processes are sent back to the parent
+process, so that they end up in the same log files.
+"""
+import atexit
+import logging
+import multiprocessing
+from threading import Lock
+from logging.handlers import QueueListener
+
+from scrapekit.exc import DependencyException, ScraperException
+from scrapekit.logs import RecordQueueHandler
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError as ie:
+    ProcessPoolExecutor = None
+    IMPORT_ERROR = ie
+
+
+class ForwardHandler(logging.Handler):
+    """ Re-emit records received from a child process through the
+    logger they were created with. """
+
+    def handle(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+# the scraper whose tasks are executed by this (child) process.
+_scraper = None
+
+
+def _init_child(scraper, log_queue):
+    """ Set up logging in a child process to forward all records to
+    the parent. """
+    global _scraper
+    _scraper = scraper
+    logger = logging.getLogger()
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(RecordQueueHandler(log_queue))
+
+
+def _call_child(name, args, kwargs, task_name, task_id):
+    """ Execute a task inside a child process. The task is looked up by
+    its name in the scraper inherited from the parent, as tasks
+    themselves cannot be sent to another process. """
+    task = _scraper.tasks[name]
+    ctx = _scraper.task_ctx
+    ctx.name, ctx.id = task_name, task_id
+    try:
+        value = task.fn(*args, **kwargs)
+        if hasattr(value, '__next__') or hasattr(value, 'next'):
+            # generators cannot be sent back to the parent process.
+            value = list(value)
+        return value
+    finally:
+        ctx.name, ctx.id = None, None
+
+
+class ProcessPool(object):
+    """ A pool of worker processes shared by all tasks of a scraper
+    which use the ``process`` executor. """
+
+    def __init__(self, scraper, processes=None):
+        self.scraper = scraper
+        self.processes = int(processes or multiprocessing.cpu_count())
+        self.executor = None
+        self.listener = None
+        self.tasks = {}
+        self.lock = Lock()
+
+    def start(self):
+        """ Fork the worker processes, unless this has been done before.
+        This should happen in the main thread, before the worker threads
+        of the task manager are started, as a process forked while other
+        threads are running may inherit locks which are never released.
+        Only tasks defined before this call can be run in the pool. """
+        with self.lock:
+            if self.executor is None:
+                self._start()
+
+    def _start(self):
+        if ProcessPoolExecutor is None:
+            raise DependencyException(IMPORT_ERROR)
+        try:
+            context = multiprocessing.get_context('fork')
+        except ValueError:
+            raise ScraperException('The process executor requires a '
+                                   'platform which supports fork().')
+        self.tasks = dict(self.scraper.tasks)
+        log_queue = context.Queue()
+        self.listener = QueueListener(log_queue, ForwardHandler())
+        self.listener.start()
+        # with fork, the scraper is inherited rather than pickled.
+        self.executor = ProcessPoolExecutor(max_workers=self.processes,
+                                            mp_context=context,
+                                            initializer=_init_child,
+                                            initargs=(self.scraper,
+                                                      log_queue))
+        # the children are forked when the first call is submitted.
+        self.executor.submit(int).result()
+        atexit.register(self.shutdown)
+
+    def call(self, task, args, kwargs):
+        """ Run the function of a task in a child process and return
+        its result. """
+        self.start()
+        if self.tasks.get(task.name) is not task:
+            raise ScraperException('Task %r was not defined when the '
+                                   'worker processes were started, or its '
+                                   'name is not unique. Define all tasks '
+                                   'which use the process executor before '
+                                   'queueing any work.' % task.name)
+        ctx = self.scraper.task_ctx
+        future = self.executor.submit(_call_child, task.name, args, kwargs,
+                                      ctx.name, ctx.id)
+        return future.result()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.listener.stop()
+            self.executor = None
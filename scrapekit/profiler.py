@@ -0,0 +1,146 @@
+"""
+A sampling profiler for tasks. When the ``profile`` setting is
+enabled, a background thread periodically looks at the stack of each
+thread that is executing a task, and counts the functions it finds
+there for the name of the task. This keeps the overhead low enough to
+profile a complete scraper run, and shows where the time of each task
+goes: to the network, to parsing or to the code of the task itself.
+
+The results are written to the ``profile`` directory in the
+``data_path`` (one JSON file per scraper run), and the functions found
+most often are listed on the task pages of the report.
+
+Tasks executed with ``executor='process'`` are seen waiting for the
+result of the child process; the work in the child is not sampled.
+Samples are attributed to tasks by thread, so with the ``asyncio``
+engine only tasks which are plain functions (and run in its thread
+pool) are profiled, not coroutines.
+"""
+import os
+import sys
+import json
+import time
+import atexit
+from threading import Thread, Lock
+try:
+    from threading import get_ident
+except ImportError:
+    from thread import get_ident
+
+from scrapekit.tasks import Task
+
+# The number of functions kept per task in the results.
+MAX_FUNCTIONS = 100
+
+
+def profile_path(scraper, scraper_id):
+    """ Determine the file name for the profile of a scraper run. """
+    return os.path.join(scraper.config.data_path, 'profile',
+                        '%s.json' % scraper_id)
+
+
+def function_name(code):
+    return '%s (%s:%s)' % (code.co_name, code.co_filename,
+                           code.co_firstlineno)
+
+
+class Profiler(Thread):
+    """ Sample the stacks of the threads executing tasks. For each task
+    name, two numbers are kept per function: the number of samples in
+    which it was executing itself (``self``), and the number in which
+    it was anywhere on the stack (``total``). """
+
+    def __init__(self, scraper, interval=0.01):
+        super(Profiler, self).__init__()
+        self.daemon = True
+        self.scraper = scraper
+        self.interval = interval
+        self.active = {}
+        self.tasks = {}
+        self.lock = Lock()
+        # frames below the call of a task are not counted.
+        self.boundary = Task.__call__.__code__
+
+    def enter(self, name):
+        """ Note that the current thread has begun to execute a task. """
+        self.active.setdefault(get_ident(), []).append(name)
+
+    def leave(self):
+        """ Note that the current thread has finished a task. """
+        stack = self.active.get(get_ident())
+        if stack:
+            stack.pop()
+
+    def sample(self):
+        frames = sys._current_frames()
+        with self.lock:
+            for ident, stack in list(self.active.items()):
+                frame = frames.get(ident)
+                if not stack or frame is None:
+                    continue
+                task = self.tasks.setdefault(stack[-1], {'samples': 0,
+                                                         'functions': {}})
+                task['samples'] += 1
+                functions = task['functions']
+                seen, top = set(), True
+                while frame is not None and frame.f_code is not self.boundary:
+                    name = function_name(frame.f_code)
+                    counts = functions.setdefault(name, [0, 0])
+                    if top:
+                        counts[0] += 1
+                        top = False
+                    if name not in seen:
+                        counts[1] += 1
+                        seen.add(name)
+                    frame = frame.f_back
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.sample()
+
+    def results(self):
+        """ Get the samples taken so far, with the functions of each
+        task ordered by the number of samples they were executing. """
+        tasks = {}
+        with self.lock:
+            for name, task in self.tasks.items():
+                functions = sorted(task['functions'].items(),
+                                   key=lambda f: f[1], reverse=True)
+                functions = [{'function': n, 'self': c[0], 'total': c[1]}
+                             for (n, c) in functions[:MAX_FUNCTIONS]]
+                tasks[name] = {'samples': task['samples'],
+                               'functions': functions}
+        return {'interval': self.interval, 'tasks': tasks}
+
+    def write(self):
+        """ Store the results in the data path. """
+        path = profile_path(self.scraper, self.scraper.id)
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+        with open(path, 'w') as fh:
+            json.dump(self.results(), fh)
+
+
+def load_profile(scraper, scraper_id):
+    """ Read the results for a scraper run, if it has been profiled. """
+    if scraper_id is None:
+        return None
+    path = profile_path(scraper, scraper_id)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as fh:
+        return json.load(fh)
+
+
+def make_profiler(scraper):
+    """ Start profiling tasks, if the ``profile`` setting is enabled. """
+    if not scraper.config.profile:
+        return None
+    interval = float(scraper.config.profile_interval)
+    profiler = Profiler(scraper, interval=interval)
+    profiler.start()
+    atexit.register(profiler.write)
+    return profiler
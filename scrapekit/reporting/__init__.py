@@ -1,7 +1,12 @@
+import json
 from os import path
 
 from scrapekit.reporting import db
 from scrapekit.reporting import render
+from scrapekit.profiler import load_profile
+
+# The number of functions listed in the profile of a task.
+PROFILE_FUNCTIONS = 15
 
 
 RUNS_QUERY = """
@@ -45,10 +50,25 @@ SELECT DISTINCT scraperId, taskName FROM log ORDER BY asctime DESC
 """
 
 
-def aggregate_loglevels(sql, keys, **kwargs):
+THROUGHPUT_QUERY = """
+SELECT substr(started, 1, 16) AS minute, COUNT(*) AS tasks
+FROM (SELECT MIN(asctime) AS started FROM log
+    WHERE scraperId IS :scraperId AND taskName IS :taskName
+    GROUP BY taskId)
+GROUP BY minute ORDER BY minute
+"""
+
+
+TASK_RUN_ROWS = """
+SELECT data FROM log WHERE scraperId IS :scraperId AND taskId IS :taskId
+ORDER BY rowid
+"""
+
+
+def aggregate_loglevels(conn, sql, keys, **kwargs):
     data, key = {}, None
-    for row in db.query(sql, **kwargs):
-        row_key = map(lambda k: row[k], keys)
+    for row in db.query(conn, sql, **kwargs):
+        row_key = [row[k] for k in keys]
         if key != row_key:
             if key is not None:
                 yield data
@@ -73,51 +93,104 @@ def sort_aggregates(rows):
     return sorted(rows, key=key)
 
 
-def all_task_runs(scraper, keys=('scraperId', 'taskId')):
-    by_task = {}
-    for row in db.log_parse(scraper):
+def throughput(conn, scraperId, taskName):
+    """ Count the task runs started in each minute of a scraper run. """
+    rows = list(db.query(conn, THROUGHPUT_QUERY, scraperId=scraperId,
+                         taskName=taskName))
+    peak = max([row['tasks'] for row in rows] or [0])
+    for row in rows:
+        row['share'] = int(100 * row['tasks'] / peak)
+    return rows
+
+
+def hot_functions(profile, taskName):
+    """ List the functions a task has spent most of its time in, with
+    their share of the samples taken. """
+    task = (profile or {}).get('tasks', {}).get(taskName)
+    if task is None or not task['samples']:
+        return []
+    functions = []
+    for function in task['functions'][:PROFILE_FUNCTIONS]:
+        functions.append({
+            'function': function['function'],
+            'self': 100.0 * function['self'] / task['samples'],
+            'total': 100.0 * function['total'] / task['samples']
+        })
+    return functions
+
+
+def task_run_rows(conn, scraperId, taskId):
+    rows = []
+    for row in db.query(conn, TASK_RUN_ROWS, scraperId=scraperId,
+                        taskId=taskId):
+        row = json.loads(row['data'])
         asctime = row.get('asctime')
         row['ts'] = '-' if asctime is None else asctime.rsplit(' ')[-1]
-        row_key = tuple(map(lambda k: row.get(k), keys))
-        if row_key not in by_task:
-            by_task[row_key] = [row]
-        else:
-            by_task[row_key].append(row)
-    return by_task
+        rows.append(row)
+    return rows
 
 
 def generate(scraper):
-    db.load(scraper)
-    runs = list(aggregate_loglevels(RUNS_QUERY, ('scraperId',)))
-    tasks = list(aggregate_loglevels(TASKS_QUERY, ('scraperId', 'taskName')))
-    index_file = render.paginate(scraper, runs, 'index%s.html', 'index.html',
-                                 tasks=tasks)
+    """ Update the report for the scraper. Only the log records written
+    since the last report are read, and only the pages of the tasks
+    which received new records are rendered again. """
+    conn = db.connect(scraper)
+    renderer = render.Renderer(scraper,
+                               processes=scraper.config.report_processes)
+    try:
+        index_file = _generate(scraper, conn, renderer)
+        renderer.close()
+    except:
+        renderer.terminate()
+        raise
+    finally:
+        conn.close()
+    return index_file
+
+
+def _generate(scraper, conn, renderer):
+    tasks, task_runs = db.load(scraper, conn)
+    runs = list(aggregate_loglevels(conn, RUNS_QUERY, ('scraperId',)))
+    aggregates = aggregate_loglevels(conn, TASKS_QUERY,
+                                     ('scraperId', 'taskName'))
+    index_file = render.paginate(renderer, runs, 'index%s.html', 'index.html',
+                                 tasks=list(aggregates))
+    base_path = renderer.context['reports_path']
 
-    for task_run in db.query(TASK_RUNS_LIST):
+    profiles = {}
+    for task_run in db.query(conn, TASK_RUNS_LIST):
         task = task_run.get('taskName') or render.PADDING
         file_name = '%s/%s/index%%s.html' % (task, task_run.get('scraperId'))
-        if path.exists(path.join(path.dirname(index_file), file_name % '')):
+        key = (task_run.get('scraperId'), task_run.get('taskName'))
+        if key not in tasks and \
+                path.exists(path.join(base_path, file_name % '')):
             continue
         if task_run.get('taskName') is None:
-            runs = aggregate_loglevels(TASK_RUNS_QUERY_NULL, ('taskId',),
+            runs = aggregate_loglevels(conn, TASK_RUNS_QUERY_NULL,
+                                       ('taskId',),
                                        scraperId=task_run.get('scraperId'))
         else:
-            runs = aggregate_loglevels(TASK_RUNS_QUERY, ('taskId',),
+            runs = aggregate_loglevels(conn, TASK_RUNS_QUERY, ('taskId',),
                                        scraperId=task_run.get('scraperId'),
                                        taskName=task_run.get('taskName'))
         runs = sort_aggregates(runs)
-        render.paginate(scraper, runs, file_name, 'task_run_list.html',
-                        taskName=task)
-
-    for (scraperId, taskId), rows in all_task_runs(scraper).items():
+        scraperId = task_run.get('scraperId')
+        if scraperId not in profiles:
+            profiles[scraperId] = load_profile(scraper, scraperId)
+        render.paginate(renderer, runs, file_name, 'task_run_list.html',
+                        taskName=task,
+                        profile=hot_functions(profiles[scraperId],
+                                              task_run.get('taskName')),
+                        throughput=throughput(conn, task_run.get('scraperId'),
+                                              task_run.get('taskName')))
+
+    for (scraperId, taskId) in task_runs:
+        rows = task_run_rows(conn, scraperId, taskId)
         taskName = rows[0].get('taskName')
         file_name = (taskName or render.PADDING,
                      scraperId or render.PADDING,
                      taskId or render.PADDING)
         file_name = '%s/%s/%s%%s.html' % file_name
-        if path.exists(path.join(path.dirname(index_file), file_name % '')):
-            continue
-        render.paginate(scraper, rows, file_name, 'task_run_item.html',
+        render.paginate(renderer, rows, file_name, 'task_run_item.html',
                         scraperId=scraperId, taskId=taskId, taskName=taskName)
-
     return index_file
@@ -1,10 +1,15 @@
+import os
 import json
 import sqlite3
+from itertools import chain
 
-from scrapekit.logs import log_path
+from scrapekit.logs import log_path, msglog_paths
+from scrapekit.msglog import MsgpackReader
 
 
-conn = sqlite3.connect(':memory:')
+BATCH_SIZE = 10000
+INSERT_QUERY = """INSERT INTO log (scraperId, taskName, scraperStartTime,
+    asctime, levelname, taskId, data) VALUES (?, ?, ?, ?, ?, ?, ?)"""
 
 
 def dict_factory(cursor, row):
@@ -14,33 +19,121 @@ def dict_factory(cursor, row):
     return d
 
 
-def log_parse(scraper):
+def connect(scraper):
+    """ Open the report index of the scraper. The index is a SQLite
+    database which holds all log records read so far and the position
+    in the log file up to which it has been read. It is kept in the
+    file given by the ``report_db`` setting (``report.db`` in the data
+    path by default), so that it can be re-used by the next report. If
+    set to ``:memory:``, the index is rebuilt for every report. """
+    path = scraper.config.report_db
+    if path is None:
+        path = os.path.join(scraper.config.data_path, 'report.db')
+    conn = sqlite3.connect(path)
+    conn.row_factory = dict_factory
+    # The index can always be rebuilt from the log, so durability can
+    # be traded for speed.
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""CREATE TABLE IF NOT EXISTS log (scraperId text,
+        taskName text, scraperStartTime datetime, asctime text,
+        levelname text, taskId text, data text)""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS log_task ON log
+        (scraperId, taskName, taskId)""")
+    conn.execute("""CREATE INDEX IF NOT EXISTS log_task_run ON log
+        (scraperId, taskId)""")
+    conn.execute("""CREATE TABLE IF NOT EXISTS state (key text
+        PRIMARY KEY, value integer)""")
+    conn.commit()
+    return conn
+
+
+def get_state(conn):
+    rows = conn.execute("SELECT key, value FROM state")
+    state = {'offset': 0}
+    state.update((row['key'], row['value']) for row in rows)
+    return state
+
+
+def log_parse(scraper, state):
+    """ Read the records written to the JSON log after the offset kept
+    in ``state``, yielding each record and its raw JSON. Lines which
+    are still being written (i.e. have no line break yet) are left for
+    later. """
     path = log_path(scraper)
-    with open(path, 'r') as fh:
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb') as fh:
+        fh.seek(state['offset'])
         for line in fh:
+            if not line.endswith(b'\n'):
+                break
+            state['offset'] += len(line)
+            line = line.decode('utf-8')
             data = json.loads(line)
             if data.get('scraperName') != scraper.name:
                 continue
-            yield data
+            yield data, line
 
 
-def load(scraper):
-    conn.row_factory = dict_factory
-    conn.execute("""CREATE TABLE IF NOT EXISTS log (scraperId text,
-        taskName text, scraperStartTime datetime, asctime text,
-        levelname text, taskId text)""")
-    conn.commit()
-    for data in log_parse(scraper):
-        conn.execute("""INSERT INTO log (scraperId, taskName,
-            scraperStartTime, asctime, levelname, taskId) VALUES
-            (?, ?, ?, ?, ?, ?)""",
-            (data.get('scraperId'), data.get('taskName'),
-             data.get('scraperStartTime'), data.get('asctime'),
-             data.get('levelname'), data.get('taskId')))
+def msglog_keys(path):
+    """ The keys of the read offset and of the position of the string
+    table of a compact log file in ``state``. """
+    name = os.path.basename(path)
+    return 'msgpack_offset:' + name, 'msgpack_start:' + name
+
+
+def msglog_parse(scraper, state):
+    """ Read the records written to the compact logs after the offsets
+    kept in ``state``. """
+    for path in msglog_paths(scraper):
+        offset_key, start_key = msglog_keys(path)
+        reader = MsgpackReader(path)
+        records = reader.read(state.get(offset_key, 0),
+                              state.get(start_key, 0))
+        for data, offset in records:
+            state[offset_key] = offset
+            state[start_key] = reader.start
+            if data.get('scraperName') != scraper.name:
+                continue
+            yield data, json.dumps(data, default=str)
+
+
+def load(scraper, conn):
+    """ Add the records written to the logs since the last report to the
+    index. Returns the set of ``(scraperId, taskName)`` and the set of
+    ``(scraperId, taskId)`` which have received new records. """
+    state = get_state(conn)
+    paths = [('offset', log_path(scraper))]
+    paths.extend((msglog_keys(p)[0], p) for p in msglog_paths(scraper))
+    for key, path in paths:
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if state.get(key, 0) > size:
+            # A log file has been replaced, start from scratch.
+            conn.execute("DELETE FROM log")
+            conn.execute("DELETE FROM state")
+            state = {'offset': 0}
+            break
+
+    tasks, task_runs, batch = set(), set(), []
+    records = chain(log_parse(scraper, state), msglog_parse(scraper, state))
+    for data, line in records:
+        batch.append((data.get('scraperId'), data.get('taskName'),
+                      data.get('scraperStartTime'), data.get('asctime'),
+                      data.get('levelname'), data.get('taskId'), line))
+        tasks.add((data.get('scraperId'), data.get('taskName')))
+        task_runs.add((data.get('scraperId'), data.get('taskId')))
+        if len(batch) >= BATCH_SIZE:
+            conn.executemany(INSERT_QUERY, batch)
+            batch = []
+    conn.executemany(INSERT_QUERY, batch)
+    conn.executemany("INSERT OR REPLACE INTO state (key, value) "
+                     "VALUES (?, ?)", state.items())
     conn.commit()
+    return tasks, task_runs
 
 
-def query(sql, **kwargs):
+def query(conn, sql, **kwargs):
     rp = conn.execute(sql, kwargs)
     for row in rp.fetchall():
         yield row
@@ -1,6 +1,8 @@
+import io
 import os
 import math
 import platform
+import multiprocessing
 import pkg_resources
 from datetime import datetime
 from collections import namedtuple
@@ -21,39 +23,139 @@ def datetimeformat(value):
     if value is None:
         return 'no date'
     if not isinstance(value, datetime):
-        value = datetime.strptime(value, '%Y-%m-%dT%H:%M')
+        value = datetime.strptime(value[:16], '%Y-%m-%dT%H:%M')
     return value.strftime(outfmt)
 
 
-def render(scraper, dest_file, template, **kwargs):
+_environment = None
+
+
+def get_environment():
+    """ Create the template environment once per process; templates are
+    compiled on first use and then kept in the environment's cache. """
+    global _environment
+    if _environment is None:
+        loader = PackageLoader('scrapekit', 'templates')
+        _environment = Environment(loader=loader, cache_size=-1)
+        _environment.filters['dateformat'] = datetimeformat
+    return _environment
+
+
+def make_context(scraper):
+    """ Collect the values shared by all pages of a report. Only plain
+    data is included, so that the context can be sent to the worker
+    processes. """
     reports_path = scraper.config.reports_path
     if reports_path is None:
         reports_path = os.path.join(scraper.config.data_path, 'reports')
-    dest_file = os.path.join(reports_path, dest_file)
+    try:
+        version = pkg_resources.require("scrapekit")[0].version
+    except pkg_resources.DistributionNotFound:
+        version = None
+    return {
+        'reports_path': reports_path,
+        'version': version,
+        'python': platform.python_version(),
+        'hostname': platform.uname()[1],
+        'padding': PADDING,
+        'ignore_fields': IGNORE_FIELDS,
+        'config': list(scraper.config.items()),
+        'scraper': {'name': scraper.name}
+    }
+
+
+_context = None
+
+
+def _init_worker(context):
+    global _context
+    _context = context
+    get_environment()
+
+
+def _render_pages(jobs):
+    for (dest_file, template, kwargs) in jobs:
+        render_page(_context, dest_file, template, kwargs)
+
+
+def render_page(context, dest_file, template, kwargs):
+    dest_file = os.path.join(context['reports_path'], dest_file)
     dest_path = os.path.dirname(dest_file)
     try:
         os.makedirs(dest_path)
     except:
         pass
 
-    loader = PackageLoader('scrapekit', 'templates')
-    env = Environment(loader=loader)
-    env.filters['dateformat'] = datetimeformat
-    template = env.get_template(template)
-    kwargs['version'] = pkg_resources.require("scrapekit")[0].version
-    kwargs['python'] = platform.python_version()
-    kwargs['hostname'] = platform.uname()[1]
-    kwargs['padding'] = PADDING
-    kwargs['ignore_fields'] = IGNORE_FIELDS
-    kwargs['config'] = scraper.config.items()
-    kwargs['scraper'] = scraper
-    with open(dest_file, 'w') as fh:
-        text = template.render(**kwargs)
-        fh.write(text.encode('utf-8'))
+    template = get_environment().get_template(template)
+    kwargs.update(context)
+    with io.open(dest_file, 'w', encoding='utf-8') as fh:
+        fh.write(template.render(**kwargs))
     return dest_file
 
 
-def paginate(scraper, elements, basename, template, **kwargs):
+class Renderer(object):
+    """ Renders the pages of a report, either directly or - if more
+    than one process is to be used - by handing batches of pages to a
+    pool of worker processes. """
+
+    BATCH_SIZE = 50
+
+    def __init__(self, scraper, processes=1):
+        self.context = make_context(scraper)
+        self.processes = int(processes)
+        self.pool = None
+        self.batch = []
+        self.results = []
+        if self.processes > 1:
+            self.pool = multiprocessing.Pool(self.processes,
+                                             initializer=_init_worker,
+                                             initargs=(self.context,))
+
+    def render(self, dest_file, template, **kwargs):
+        """ Render a page (possibly at a later time) and return the path
+        of the file it will be written to. """
+        if self.pool is None:
+            return render_page(self.context, dest_file, template, kwargs)
+        self.batch.append((dest_file, template, kwargs))
+        if len(self.batch) >= self.BATCH_SIZE:
+            self._submit()
+        return os.path.join(self.context['reports_path'], dest_file)
+
+    def _submit(self):
+        # limit the number of batches waiting for a worker.
+        while len(self.results) >= self.processes * 4:
+            self.results.pop(0).get()
+        self.results.append(self.pool.apply_async(_render_pages,
+                                                  (self.batch,)))
+        self.batch = []
+
+    def close(self):
+        """ Wait for all pages to be written. """
+        if self.pool is None:
+            return
+        try:
+            if len(self.batch):
+                self._submit()
+            for result in self.results:
+                result.get()
+            self.pool.close()
+        except:
+            self.pool.terminate()
+            raise
+        finally:
+            self.pool.join()
+            self.pool = None
+
+    def terminate(self):
+        """ Stop rendering, without waiting for the pages in progress. """
+        if self.pool is None:
+            return
+        self.pool.terminate()
+        self.pool.join()
+        self.pool = None
+
+
+def paginate(renderer, elements, basename, template, **kwargs):
     basedir = os.path.dirname(basename)
     basefile = os.path.basename(basename)
     pages = int(math.ceil(float(len(elements)) / PAGE_SIZE))
@@ -88,6 +190,5 @@ def paginate(scraper, elements, basename, template, **kwargs):
             'prev': None if page.idx == 1 else urls[page.idx - 2],
             'next': None if page.idx == len(urls) else urls[page.idx]
         }
-        link = render(scraper, page.abs, template, pager=pager,
-                      **kwargs)
+        link = renderer.render(page.abs, template, pager=pager, **kwargs)
     return link
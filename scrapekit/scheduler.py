@@ -0,0 +1,332 @@
+"""
+Data structures used by the task managers to decide which queued task
+is executed next, and to skip tasks which have been queued before.
+
+The queue used by the :py:class:`TaskManager <scrapekit.tasks.TaskManager>`
+is chosen with the ``queue_backend`` setting: ``memory`` (the default)
+keeps it in the scraper process, while ``sqlite`` stores it in a
+database file which several scraper processes - on one machine, or on
+several machines with a shared disk - can work on together.
+"""
+import os
+import time
+import heapq
+import sqlite3
+import hashlib
+from itertools import count
+from collections import deque
+from threading import Lock, Condition, local
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+class TaskQueue(Queue):
+    """ A bounded queue which returns the queued task with the highest
+    priority first, and tasks of the same priority in the order they
+    were queued in. Items are ``(task, args, kwargs)`` tuples, and the
+    priority is taken from the task.
+
+    Besides single items, the queue also holds :py:class:`Feeder`
+    instances, which produce new items on demand. A feeder is handed
+    out by ``get`` whenever the queue is less than half full, and the
+    caller must then advance it and return it through ``refeed`` (or
+    call ``task_done`` once it is exhausted). """
+
+    def _init(self, maxsize):
+        self.heap = []
+        self.counter = count()
+        self.feeders = deque()
+        self.low_water = max(1, maxsize // 2) if maxsize > 0 else 1
+
+    def _qsize(self, len=len):
+        return len(self.heap)
+
+    def _put(self, item):
+        entry = (-item[0].priority, next(self.counter), item)
+        heapq.heappush(self.heap, entry)
+
+    def _get(self):
+        return heapq.heappop(self.heap)[-1]
+
+    def get(self):
+        """ Remove and return the next item or feeder, waiting until one
+        is available. """
+        with self.not_empty:
+            while True:
+                if self.feeders and len(self.heap) < self.low_water:
+                    return self.feeders.popleft()
+                if self.heap:
+                    item = self._get()
+                    self.not_full.notify()
+                    return item
+                self.not_empty.wait()
+
+    def force_put(self, item):
+        """ Add an item to the queue without waiting, even if this makes
+        the queue exceed its maximum size. """
+        with self.mutex:
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def feed(self, feeder):
+        """ Add a new feeder. It counts as one unfinished task until it
+        has been exhausted. """
+        with self.mutex:
+            self.feeders.append(feeder)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def refeed(self, feeder):
+        """ Return a feeder which has been advanced. """
+        with self.mutex:
+            self.feeders.append(feeder)
+            self.not_empty.notify()
+
+
+class Feeder(object):
+    """ Queues the items of an iterable for a task, one at a time, as
+    space becomes available in the queue. The iterable (often a
+    generator) is advanced in the context of the task which produced
+    it. """
+
+    def __init__(self, task, iterable, ctx):
+        self.task = task
+        self.iterator = iter(iterable)
+        self.ctx = ctx
+        self.source_name = getattr(ctx, 'name', None)
+        self.source_id = getattr(ctx, 'id', None)
+        # the journalled call which produced the iterable, if any.
+        self.call = None
+
+    def next(self):
+        """ Return the next item, raising ``StopIteration`` when the
+        iterable is exhausted. """
+        self.ctx.name = self.source_name
+        self.ctx.id = self.source_id
+        try:
+            return next(self.iterator)
+        finally:
+            self.ctx.name = None
+            self.ctx.id = None
+
+
+class SeenSet(object):
+    """ A memory-bounded set of task keys. Keys are stored as 64-bit
+    hashes, in two generations: once the current generation holds half
+    of ``size`` keys, it replaces the previous one. This means that
+    the oldest keys are forgotten first, and that a duplicate is only
+    ever missed - never wrongly detected - once the set is full. """
+
+    def __init__(self, size=1000000):
+        self.limit = max(1, int(size) // 2)
+        self.current = set()
+        self.previous = set()
+        self.lock = Lock()
+
+    @classmethod
+    def hash(cls, key):
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return int(digest[:16], 16)
+
+    def add(self, key):
+        """ Add a key to the set, returning ``False`` if it was already
+        present. """
+        key = self.hash(key)
+        with self.lock:
+            if key in self.current or key in self.previous:
+                return False
+            if len(self.current) >= self.limit:
+                self.previous = self.current
+                self.current = set()
+            self.current.add(key)
+            return True
+
+    def update(self, hashes):
+        """ Add keys which have already been hashed, e.g. when resuming
+        from the :py:class:`Journal <scrapekit.journal.Journal>`. """
+        with self.lock:
+            self.current.update(hashes)
+
+    def __len__(self):
+        return len(self.current) + len(self.previous)
+
+
+class SQLiteTaskQueue(object):
+    """ A task queue stored in an SQLite database, which is shared by
+    all scraper processes using the same ``path``. Queued calls are
+    stored with the name of their task, and are only taken off the queue
+    by processes which have a task of that name: all processes should
+    therefore set up the same tasks and pipelines. Arguments must be
+    picklable.
+
+    Calls are claimed by a worker when it takes them off the queue, and
+    deleted once they are done. If a process dies, its claims expire
+    after ``timeout`` seconds, and the calls are executed again by
+    another process. Feeders and control items (like the requests to
+    retire a worker thread) are kept in the local process.
+
+    The interface matches that of :py:class:`TaskQueue`. Items are only
+    known to the database once a worker has to wait for them, so waiting
+    is done by polling, up to every ``poll`` seconds. """
+
+    shared = True
+
+    def __init__(self, path, tasks, maxsize=0, timeout=600, poll=0.5):
+        self.path = path
+        self.tasks = tasks
+        self.timeout = timeout
+        self.poll = poll
+        self.low_water = max(1, maxsize // 2) if maxsize > 0 else 1
+        self.local = local()
+        self.mutex = Lock()
+        self.all_tasks_done = Condition(self.mutex)
+        self.items = deque()
+        self.feeders = deque()
+        # feeders, control items and claimed calls of this process.
+        self.unfinished_tasks = 0
+        conn = self.conn
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""CREATE TABLE IF NOT EXISTS queue (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, task TEXT,
+            priority INTEGER, data BLOB, claimed REAL)""")
+        conn.execute("""CREATE INDEX IF NOT EXISTS queue_next
+            ON queue (claimed, priority DESC, id)""")
+
+    @property
+    def conn(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=60,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    def put(self, item):
+        """ Add an item to the queue. This never waits, as the queue is
+        not held in memory. """
+        task, args, kwargs = item
+        if args is None:
+            with self.mutex:
+                self.items.append(item)
+                self.unfinished_tasks += 1
+            return
+        data = pickle.dumps((args, kwargs), pickle.HIGHEST_PROTOCOL)
+        self.conn.execute("INSERT INTO queue (task, priority, data) "
+                          "VALUES (?, ?, ?)",
+                          (task.name, task.priority, sqlite3.Binary(data)))
+
+    force_put = put
+
+    def _claim(self):
+        """ Take the next call of a known task off the shared queue. """
+        names = list(self.tasks.keys())
+        if not names:
+            return None
+        now = time.time()
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT id, task, data FROM queue "
+                               "WHERE (claimed IS NULL OR claimed < ?) "
+                               "AND task IN (%s) "
+                               "ORDER BY priority DESC, id LIMIT 1"
+                               % ', '.join('?' * len(names)),
+                               [now - self.timeout] + names).fetchone()
+            if row is not None:
+                conn.execute("UPDATE queue SET claimed = ? WHERE id = ?",
+                             (now, row[0]))
+        finally:
+            conn.execute("COMMIT")
+        if row is None:
+            return None
+        args, kwargs = pickle.loads(bytes(row[2]))
+        return row[0], (self.tasks[row[1]], args, kwargs)
+
+    def get(self):
+        """ Remove and return the next item or feeder, waiting until one
+        is available. """
+        self.local.claim = None
+        delay = 0.01
+        while True:
+            with self.mutex:
+                if self.items:
+                    return self.items.popleft()
+                if self.feeders and self.qsize() < self.low_water:
+                    return self.feeders.popleft()
+            claim = self._claim()
+            if claim is not None:
+                with self.mutex:
+                    self.unfinished_tasks += 1
+                self.local.claim = claim[0]
+                return claim[1]
+            with self.mutex:
+                if self.feeders:
+                    return self.feeders.popleft()
+            time.sleep(delay)
+            delay = min(delay * 2, self.poll)
+
+    def task_done(self):
+        """ Mark the last item or feeder taken by this thread as done. """
+        claim = getattr(self.local, 'claim', None)
+        if claim is not None:
+            self.conn.execute("DELETE FROM queue WHERE id = ?", (claim,))
+            self.local.claim = None
+        with self.mutex:
+            self.unfinished_tasks -= 1
+            if self.unfinished_tasks <= 0:
+                self.all_tasks_done.notify_all()
+
+    def feed(self, feeder):
+        with self.mutex:
+            self.feeders.append(feeder)
+            self.unfinished_tasks += 1
+
+    def refeed(self, feeder):
+        with self.mutex:
+            self.feeders.append(feeder)
+
+    def qsize(self):
+        """ The number of calls waiting in the shared queue. """
+        row = self.conn.execute("SELECT COUNT(*) FROM queue "
+                                "WHERE claimed IS NULL").fetchone()
+        return row[0]
+
+    def join(self):
+        """ Wait until this process has no work left, and the shared
+        queue is empty. """
+        while True:
+            with self.mutex:
+                while self.unfinished_tasks > 0:
+                    self.all_tasks_done.wait()
+            row = self.conn.execute("SELECT COUNT(*) FROM queue").fetchone()
+            if row[0] == 0:
+                return
+            time.sleep(self.poll)
+
+
+def make_queue_factory(scraper):
+    """ Get a function which creates the task queue configured for the
+    scraper, given its maximum size. """
+    backend = scraper.config.queue_backend
+    if backend == 'memory':
+        return TaskQueue
+    if backend == 'sqlite':
+        path = scraper.config.queue_path or \
+            os.path.join(scraper.config.data_path, 'queue.sqlite')
+        timeout = float(scraper.config.queue_timeout)
+
+        def factory(maxsize):
+            return SQLiteTaskQueue(path, scraper.tasks, maxsize=maxsize,
+                                   timeout=timeout)
+        factory.shared = True
+        return factory
+    raise ValueError('Unknown queue backend: %r' % backend)
@@ -0,0 +1,268 @@
+"""
+Statistics about a running scraper, collected from its
+:py:class:`Metrics <scrapekit.metrics.Metrics>`: the number, duration
+and rate of calls of each task, the state of the task queue, HTTP
+status codes and the cache hit ratio.
+
+Apart from :py:meth:`Scraper.stats <scrapekit.core.Scraper.stats>`,
+the statistics can be exported while the scraper is running: the
+``stats_port`` setting serves them via HTTP (as JSON at ``/stats`` and
+in the Prometheus text format at ``/metrics``), and ``stats_file``
+periodically writes them to a file in the Prometheus text format (e.g.
+for the textfile collector of the node exporter).
+"""
+import os
+import re
+import json
+import time
+import atexit
+from datetime import datetime
+from threading import Thread
+
+try:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+from scrapekit.metrics import split_name
+
+# The names of the labels used for each group of metrics when they are
+# exported to Prometheus.
+LABEL_NAMES = {
+    'task': 'task',
+    'queue': 'task',
+    'throttle': 'host',
+    'http': 'host',
+    'cache': 'host',
+    'cache.bytes_avoided': 'policy',
+    'cache.requests_avoided': 'policy',
+    'http.status': 'code'
+}
+GAUGES = ('task.active',)
+
+
+def collect(scraper):
+    """ Gather the statistics of the scraper into a dict. """
+    elapsed = (datetime.utcnow() - scraper.start_time).total_seconds()
+    counters = dict(scraper.metrics.items())
+    histograms = dict(scraper.metrics.histograms())
+
+    tasks, status, avoided = {}, {}, {}
+    for name, value in counters.items():
+        name, label = split_name(name)
+        if label is None:
+            continue
+        if name == 'http.status':
+            status[label] = value
+        elif name in ('cache.bytes_avoided', 'cache.requests_avoided'):
+            policy = avoided.setdefault(label, {'bytes': 0, 'requests': 0})
+            key = 'bytes' if name == 'cache.bytes_avoided' else 'requests'
+            policy[key] = value
+        elif name.startswith('task.'):
+            task = tasks.setdefault(label, {'calls': 0, 'errors': 0,
+                                            'active': 0})
+            task[name.split('.', 1)[-1]] = value
+    for name, task in tasks.items():
+        task['per_second'] = task['calls'] / elapsed if elapsed else None
+        duration = histograms.get('task.duration[%s]' % name)
+        if duration is not None:
+            task['duration'] = duration.to_dict()
+
+    hits = counters.get('cache.hits', 0)
+    misses = counters.get('cache.misses', 0)
+    memory_hits = counters.get('cache.memory_hits', 0)
+    memory_misses = counters.get('cache.memory_misses', 0)
+    # the task manager is not created here: this may run on another
+    # thread, while the scraper is still being set up.
+    task_manager = scraper._task_manager
+    if task_manager is None:
+        depth = 0
+        if scraper.config.engine == 'asyncio':
+            workers = int(scraper.config.concurrency)
+        else:
+            workers = int(scraper.config.threads)
+    else:
+        depth = task_manager.depth
+        workers = getattr(task_manager, 'concurrency', None) or \
+            task_manager.num_threads
+    http_duration = histograms.get('http.duration')
+    return {
+        'scraper': scraper.name,
+        'id': str(scraper.id),
+        'elapsed': elapsed,
+        'tasks': tasks,
+        'queue': {
+            'depth': depth,
+            'workers': workers,
+            'utilization': counters.get('task.active', 0) / float(workers)
+            if workers else None
+        },
+        'http': {
+            'requests': counters.get('http.requests', 0),
+            'coalesced': counters.get('http.coalesced', 0),
+            'status': status,
+            'duration': http_duration.to_dict() if http_duration else None
+        },
+        'cache': {
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': hits / float(hits + misses)
+            if hits + misses else None,
+            'avoided': avoided,
+            'memory': {
+                'hits': memory_hits,
+                'misses': memory_misses,
+                'hit_ratio': memory_hits / float(memory_hits + memory_misses)
+                if memory_hits + memory_misses else None
+            }
+        },
+        'metrics': counters
+    }
+
+
+def _metric_name(name):
+    return 'scrapekit_' + re.sub(r'[^a-zA-Z0-9_]', '_', name)
+
+
+def _labels(name, label, **extra):
+    labels = []
+    if label is not None:
+        label_name = LABEL_NAMES.get(name,
+                                     LABEL_NAMES.get(name.split('.')[0],
+                                                     'label'))
+        labels.append((label_name, label))
+    labels.extend(sorted(extra.items()))
+    if not labels:
+        return ''
+    labels = ['%s="%s"' % (k, str(v).replace('\\', '\\\\')
+                           .replace('"', '\\"').replace('\n', '\\n'))
+              for (k, v) in labels]
+    return '{%s}' % ','.join(labels)
+
+
+def _group(items):
+    """ Group metrics by name. If a metric has labelled values, only
+    those are exported, as the total can be computed from them. """
+    groups = {}
+    for name, value in items:
+        name, label = split_name(name)
+        groups.setdefault(name, []).append((label, value))
+    for name in sorted(groups):
+        values = groups[name]
+        labelled = [(l, v) for (l, v) in values if l is not None]
+        yield name, labelled or values
+
+
+def prometheus_text(scraper):
+    """ Render the statistics of the scraper in the Prometheus text
+    exposition format. """
+    stats = collect(scraper)
+    lines = []
+    for name, values in _group(scraper.metrics.items()):
+        kind = 'gauge' if name in GAUGES else 'counter'
+        metric = _metric_name(name)
+        if kind == 'counter':
+            metric += '_total'
+        lines.append('# TYPE %s %s' % (metric, kind))
+        for label, value in values:
+            lines.append('%s%s %s' % (metric, _labels(name, label), value))
+
+    for name, values in _group(scraper.metrics.histograms()):
+        metric = _metric_name(name) + '_seconds'
+        lines.append('# TYPE %s histogram' % metric)
+        for label, histogram in values:
+            cumulative = 0
+            bounds = list(histogram.buckets) + ['+Inf']
+            for bound, count in zip(bounds, histogram.counts):
+                cumulative += count
+                labels = _labels(name, label, le=bound)
+                lines.append('%s_bucket%s %s' % (metric, labels, cumulative))
+            labels = _labels(name, label)
+            lines.append('%s_sum%s %s' % (metric, labels, histogram.sum))
+            lines.append('%s_count%s %s' % (metric, labels, histogram.count))
+
+    for name in ('depth', 'workers', 'utilization'):
+        metric = _metric_name('queue.' + name)
+        lines.append('# TYPE %s gauge' % metric)
+        lines.append('%s %s' % (metric, stats['queue'][name] or 0))
+    lines.append('# TYPE scrapekit_elapsed_seconds gauge')
+    lines.append('scrapekit_elapsed_seconds %s' % stats['elapsed'])
+    return '\n'.join(lines) + '\n'
+
+
+class StatsRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        scraper = self.server.scraper
+        if self.path.startswith('/metrics'):
+            body = prometheus_text(scraper)
+            content_type = 'text/plain; version=0.0.4'
+        elif self.path in ('/', '/stats'):
+            body = json.dumps(collect(scraper), default=str)
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # keep requests for the statistics out of the scraper log.
+        pass
+
+
+class StatsServer(ThreadingMixIn, HTTPServer):
+    """ A local HTTP server for the statistics of a scraper. """
+    daemon_threads = True
+
+    def __init__(self, scraper, port, host='127.0.0.1'):
+        HTTPServer.__init__(self, (host, port), StatsRequestHandler)
+        self.scraper = scraper
+
+    def start(self):
+        thread = Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+
+class StatsWriter(Thread):
+    """ A background thread which periodically writes the statistics
+    of a scraper to a file, in the Prometheus text format. """
+
+    def __init__(self, scraper, path, interval=10):
+        super(StatsWriter, self).__init__()
+        self.daemon = True
+        self.scraper = scraper
+        self.path = path
+        self.interval = interval
+
+    def write(self):
+        # replace the file at once, so readers never see half of it.
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fh:
+            fh.write(prometheus_text(self.scraper))
+        os.rename(tmp_path, self.path)
+
+    def run(self):
+        while True:
+            self.write()
+            time.sleep(self.interval)
+
+
+def start_exporters(scraper):
+    """ Start serving or writing the statistics of the scraper, if the
+    ``stats_port`` or ``stats_file`` settings ask for it. """
+    port = int(scraper.config.stats_port or 0)
+    if port > 0:
+        StatsServer(scraper, port).start()
+    if scraper.config.stats_file:
+        writer = StatsWriter(scraper, scraper.config.stats_file,
+                             interval=float(scraper.config.stats_interval))
+        writer.start()
+        atexit.register(writer.write)
@@ -5,17 +5,23 @@ several stages and to have multiple elements processed at the same
 time.
 
 The goal of this module is to handle simple multi-threaded scrapers,
-while making it easy to upgrade to a queue-based setup using celery
-later.
+while making it easy to upgrade to a queue-based setup later: the queue
+can be replaced with one that is shared by several scraper processes
+(see :py:mod:`scrapekit.scheduler`).
 """
 
 from uuid import uuid4
-from time import sleep
+from time import sleep, time
+from threading import Thread, Lock, local
+from contextlib import contextmanager
 try:
-    from queue import Queue
+    from contextvars import ContextVar
 except ImportError:
-    from Queue import Queue
-from threading import Thread
+    ContextVar = None
+
+from scrapekit.metrics import Metrics
+from scrapekit.scheduler import TaskQueue, Feeder, SeenSet
+from scrapekit.journal import PendingCall
 
 
 class TaskManager(object):
@@ -23,36 +29,138 @@ class TaskManager(object):
     used to parallelize processing and the queue that manages the
     current set of prepared tasks. """
 
-    def __init__(self, threads=10):
+    def __init__(self, threads=10, dedup_size=1000000, metrics=None,
+                 max_threads=0, journal=None, queue_factory=None):
         """
         :param threads: The number of threads to be spawned. Values
             ranging from 5 to 40 have shown useful, based on the amount
             of I/O involved in each task.
-        :param daemon: Mark the worker threads as daemons in the
-            operating system, so that they will not be included in the
-            number of application threads for this script.
+        :param dedup_size: The number of task keys to remember for
+            tasks which skip duplicate calls.
+        :param metrics: A :py:class:`Metrics <scrapekit.metrics.Metrics>`
+            instance to record queue statistics in.
+        :param max_threads: If larger than ``threads``, the number of
+            threads is adjusted while the scraper is running, between
+            ``threads`` and ``max_threads``. See :py:class:`PoolSizer`.
+        :param journal: A :py:class:`Journal <scrapekit.journal.Journal>`
+            to record queued and completed calls in.
+        :param queue_factory: A function which creates the queue, given
+            its maximum size. Defaults to an in-memory
+            :py:class:`TaskQueue <scrapekit.scheduler.TaskQueue>`.
         """
-        self.num_threads = int(threads)
+        self.num_threads = self.min_threads = int(threads)
+        self.max_threads = max(int(max_threads or 0), self.num_threads)
         self.queue = None
+        self.seen = SeenSet(dedup_size)
+        self.metrics = metrics or Metrics()
+        self.journal = journal
+        self.queue_factory = queue_factory or TaskQueue
+        self._lock = Lock()
+        self._local = local()
+        self._blocked = 0
+        self._retire = 0
 
     def _spawn(self):
         """ Initialize the queue and the threads. """
-        self.queue = Queue(maxsize=self.num_threads * 10)
+        self.queue = self.queue_factory(maxsize=self.max_threads * 10)
         for i in range(self.num_threads):
-            t = Thread(target=self._consume)
-            t.daemon = True
-            t.start()
+            self._start_worker()
+        if self.max_threads > self.num_threads:
+            PoolSizer(self).start()
+
+    def _start_worker(self):
+        t = Thread(target=self._consume)
+        t.daemon = True
+        t.start()
 
     def _consume(self):
         """ Main loop for each thread, handles picking a task off the
         queue, processing it and notifying the queue that it is done.
         """
+        self._local.worker = True
         while True:
+            item = self.queue.get()
+            if isinstance(item, Feeder):
+                self._advance(item)
+                continue
+            task, args, kwargs = item
+            if task is RETIRE:
+                self.queue.task_done()
+                return
+            call = None
+            if self.journal is not None:
+                call = PendingCall(self.journal, task.key(args, kwargs))
+                self._local.call = call
             try:
-                task, args, kwargs = self.queue.get(True)
                 task(*args, **kwargs)
             finally:
+                if call is not None:
+                    self._local.call = None
+                    call.release()
                 self.queue.task_done()
+            if self._retire > 0:
+                with self._lock:
+                    if self._retire > 0:
+                        self._retire -= 1
+                        return
+
+    def _advance(self, feeder):
+        """ Queue the next item produced by a feeder. """
+        try:
+            value = feeder.next()
+        except StopIteration:
+            self._exhausted(feeder)
+            return
+        except Exception as e:
+            feeder.task.scraper.log.exception(e)
+            self._exhausted(feeder)
+            return
+        try:
+            feeder.task.queue(value)
+        finally:
+            self.queue.refeed(feeder)
+
+    def _exhausted(self, feeder):
+        if feeder.call is not None:
+            feeder.call.release()
+        self.queue.task_done()
+
+    @contextmanager
+    def blocking(self):
+        """ Wrap a section of code in which the current worker thread
+        will wait for something other than the queue, e.g. for a rate
+        limit to allow another request. To keep other queued tasks
+        moving, a stand-in worker is started for the duration of the
+        wait (with at most ``num_threads`` stand-ins at any time). """
+        if not getattr(self._local, 'worker', False):
+            yield
+            return
+        with self._lock:
+            replace = self._blocked < self.num_threads
+            if replace:
+                self._blocked += 1
+        if replace:
+            self._start_worker()
+        try:
+            yield
+        finally:
+            if replace:
+                with self._lock:
+                    self._blocked -= 1
+                    self._retire += 1
+
+    def resize(self, threads):
+        """ Change the number of worker threads, within the bounds
+        given by ``threads`` and ``max_threads``. Surplus workers
+        finish their current task and then exit. """
+        threads = min(max(int(threads), self.min_threads), self.max_threads)
+        with self._lock:
+            change = threads - self.num_threads
+            self.num_threads = threads
+        for i in range(change):
+            self._start_worker()
+        for i in range(-change):
+            self.queue.force_put((RETIRE, None, None))
 
     def put(self, task, args, kwargs):
         """ Add a new item to the queue. An item is a task and the
@@ -60,22 +168,189 @@ class TaskManager(object):
 
         Do not call this directly, use Task.queue/Task.run instead.
         """
+        dedup = task.dedup
+        if dedup or self.journal is not None:
+            key = task.key(args, kwargs)
+            if self.journal is not None and self.journal.is_resumed(key):
+                # the call was completed, or is queued again, by the run
+                # being resumed.
+                self.metrics.incr('journal.skipped', label=task.name)
+                return
+            if dedup and not self.seen.add(key):
+                self.metrics.incr('queue.dedup_hits', label=task.name)
+                return
         if self.num_threads == 0:
             return task(*args, **kwargs)
         if self.queue is None:
             self._spawn()
-        self.queue.put((task, args, kwargs))
+        if self.journal is not None:
+            self.journal.queued(task, args, kwargs)
+        self._enqueue(task, args, kwargs)
+
+    def restore(self, task, args, kwargs):
+        """ Queue a call which was pending when an earlier run of the
+        scraper stopped, without checking or recording it again. """
+        if self.num_threads == 0:
+            return task(*args, **kwargs)
+        if self.queue is None:
+            self._spawn()
+        self._enqueue(task, args, kwargs)
+
+    def _enqueue(self, task, args, kwargs):
+        if getattr(self._local, 'worker', False):
+            # Workers never wait for space in the queue: if all of them
+            # did, none would be left to take items off it.
+            self.queue.force_put((task, args, kwargs))
+        else:
+            self.queue.put((task, args, kwargs))
+
+    def feed(self, task, iterable, ctx):
+        """ Queue the task for each item in an iterable. The items are
+        taken from the iterable lazily, as the queue has space for them,
+        so that a large generator will neither fill up memory nor block
+        the worker thread producing it.
+
+        Do not call this directly, use Task.pipe instead.
+        """
+        if self.num_threads == 0:
+            for item in iterable:
+                self.put(task, (item,), {})
+            return
+        if self.queue is None:
+            self._spawn()
+        feeder = Feeder(task, iterable, ctx)
+        call = getattr(self._local, 'call', None)
+        if call is not None:
+            call.hold()
+            feeder.call = call
+        self.queue.feed(feeder)
+
+    @property
+    def depth(self):
+        """ The number of tasks currently waiting in the queue. """
+        if self.queue is None:
+            return 0
+        return self.queue.qsize()
 
     def wait(self):
         """ Wait for each item in the queue to be processed. If this
         is not called, the main thread will end immediately and none
         of the tasks assigned to the threads would be executed. """
         if self.queue is None:
-            return
+            # a shared queue may hold work queued by other processes.
+            if not getattr(self.queue_factory, 'shared', False):
+                return
+            self._spawn()
 
         self.queue.join()
 
 
+class Retire(object):
+    """ Queued to make one worker thread exit. It has the highest
+    priority, so that the pool shrinks as soon as a worker is free. """
+    priority = float('inf')
+
+
+RETIRE = Retire()
+
+
+class PoolSizer(Thread):
+    """ A background thread which adjusts the number of worker threads
+    of a :py:class:`TaskManager` to the work at hand. Every ``interval``
+    seconds, it compares the recent state of the scraper with the last
+    one, and:
+
+    * shrinks the pool by a quarter if requests were held back by the
+      rate limit, or the response time of the remote sites has grown
+      to more than twice its usual value, as more threads would only
+      add to the load on a site which is struggling already;
+    * doubles the pool if tasks are waiting in the queue while all
+      workers are busy;
+    * retires half of the idle workers if the queue is empty. """
+
+    def __init__(self, manager, interval=1.0):
+        super(PoolSizer, self).__init__()
+        self.daemon = True
+        self.manager = manager
+        self.interval = interval
+        self.baseline = None
+
+    def snapshot(self):
+        metrics = self.manager.metrics
+        http = dict(metrics.histograms()).get('http.duration')
+        return {
+            'active': metrics.get('task.active'),
+            'waits': metrics.get('throttle.waits'),
+            'requests': http.count if http else 0,
+            'request_time': http.sum if http else 0.0,
+            'depth': self.manager.depth
+        }
+
+    def size(self, last, now):
+        """ Decide on the number of threads, given two snapshots. """
+        threads = self.manager.num_threads
+        step = max(1, threads // 4)
+        latency, slow = None, False
+        if now['requests'] > last['requests']:
+            latency = (now['request_time'] - last['request_time']) / \
+                (now['requests'] - last['requests'])
+            # let the usual response time drift upwards slowly, so that
+            # a site which is permanently slower is not punished.
+            if self.baseline is None or latency < self.baseline * 1.1:
+                self.baseline = latency
+            else:
+                self.baseline *= 1.1
+            slow = latency > self.baseline * 2
+        if now['waits'] > last['waits'] or slow:
+            return threads - step
+        if now['depth'] > 0 and now['active'] >= threads:
+            return threads * 2
+        if now['depth'] == 0 and now['active'] < threads:
+            return threads - max(1, (threads - now['active']) // 2)
+        return threads
+
+    def run(self):
+        last = self.snapshot()
+        while True:
+            sleep(self.interval)
+            now = self.snapshot()
+            threads = self.manager.num_threads
+            self.manager.resize(self.size(last, now))
+            change = self.manager.num_threads - threads
+            if change > 0:
+                self.manager.metrics.incr('pool.grown', change)
+            elif change < 0:
+                self.manager.metrics.incr('pool.shrunk', -change)
+            last = now
+
+
+class TaskContext(object):
+    """ Holds the name and ID of the task currently being executed.
+    Values are kept in a context variable, which keeps them separate
+    both between threads and between coroutines run by the asyncio
+    engine. """
+
+    def __init__(self):
+        object.__setattr__(self, '_var', ContextVar('task_ctx'))
+
+    def __getattr__(self, name):
+        try:
+            return self._var.get({})[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        # copy on write, as contexts copied for new coroutines share
+        # the same dict.
+        data = dict(self._var.get({}))
+        data[name] = value
+        self._var.set(data)
+
+
+if ContextVar is None:
+    TaskContext = local
+
+
 class ChainListener(object):
 
     def __init__(self, task):
@@ -91,8 +366,8 @@ class PipeListener(ChainListener):
         # TODO: if value is a generator, it will be exhausted.
         # Thus no branching or return value is available.
         # -> consider using itertools.tee.
-        for value_item in value:
-            self.task.queue(value_item)
+        scraper = self.task.scraper
+        scraper.task_manager.feed(self.task, value, scraper.task_ctx)
 
 
 class Task(object):
@@ -105,35 +380,107 @@ class Task(object):
     `pipe` and `run`).
     """
 
-    def __init__(self, scraper, fn, task_id=None):
+    def __init__(self, scraper, fn, task_id=None, priority=None,
+                 dedup=None, executor=None):
+        """
+        :param priority: Tasks with a higher priority will be executed
+            first. By default, the priority is the depth of the task in
+            its pipeline, so that later stages are processed before new
+            input is generated.
+        :param dedup: Skip calls with the same arguments as a call which
+            has already been queued. Defaults to the ``dedup`` setting.
+        :param executor: Set to ``process`` to run the function in a
+            pool of worker processes rather than a worker thread. This
+            helps with CPU-bound tasks, but requires arguments and
+            return values to be picklable.
+        """
+        if executor not in (None, 'thread', 'process'):
+            raise ValueError('Invalid executor: %r' % executor)
         self.scraper = scraper
         self.fn = fn
         self.task_id = task_id
+        self._priority = priority
+        self._dedup = dedup
+        self.executor = executor
         self._listeners = []
         self._source = None
 
+    @property
+    def name(self):
+        return getattr(self.fn, 'func_name', self.fn.__name__)
+
+    @property
+    def priority(self):
+        if self._priority is not None:
+            return self._priority
+        depth, source = 0, self._source
+        while source is not None:
+            depth, source = depth + 1, source._source
+        return depth
+
+    @property
+    def dedup(self):
+        if self._dedup is not None:
+            return self._dedup
+        return self.scraper.config.dedup
+
+    def key(self, args, kwargs):
+        """ Generate a key which identifies a call of this task with the
+        given arguments. """
+        return '%s:%r:%r' % (self.name, args, sorted(kwargs.items()))
+
     def __call__(self, *args, **kwargs):
         """ Execute the wrapped function. This will either call it in
         normal mode (returning the return value), or notify any
         pipeline listeners that have been associated with this task.
         """
-        self.scraper.task_ctx.name = getattr(self.fn, 'func_name', self.fn.__name__)
-        self.scraper.task_ctx.id = self.task_id or uuid4()
-
+        started, failed = self._begin(args, kwargs), False
         try:
-            self.scraper.log.debug('Begin task', extra={
-                'taskArgs': args,
-                'taskKwargs': kwargs
-                })
-            value = self.fn(*args, **kwargs)
-            for listener in self._listeners:
-                listener.notify(value)
+            value = self._execute(args, kwargs)
+            self._notify(value)
             return value
         except Exception as e:
+            failed = True
             self.scraper.log.exception(e)
         finally:
-            self.scraper.task_ctx.name = None
-            self.scraper.task_ctx.id = None
+            self._end(started, failed)
+
+    def _begin(self, args, kwargs, profile=True):
+        """ Set up the task context for an execution of the task, and
+        return the time at which it started. """
+        self.scraper.task_ctx.name = self.name
+        self.scraper.task_ctx.id = self.task_id or uuid4()
+        self.scraper.log.debug('Begin task', extra={
+            'taskArgs': args,
+            'taskKwargs': kwargs
+            })
+        self.scraper.metrics.incr('task.active', label=self.name)
+        if profile and self.scraper.profiler is not None:
+            self.scraper.profiler.enter(self.name)
+        return time()
+
+    def _execute(self, args, kwargs):
+        if self.executor == 'process':
+            with self.scraper.task_manager.blocking():
+                return self.scraper.process_pool.call(self, args, kwargs)
+        return self.fn(*args, **kwargs)
+
+    def _notify(self, value):
+        for listener in self._listeners:
+            listener.notify(value)
+
+    def _end(self, started, failed=False, profile=True):
+        """ Record the duration of the task and reset its context. """
+        if profile and self.scraper.profiler is not None:
+            self.scraper.profiler.leave()
+        metrics = self.scraper.metrics
+        metrics.incr('task.active', -1, label=self.name)
+        metrics.incr('task.calls', label=self.name)
+        if failed:
+            metrics.incr('task.errors', label=self.name)
+        metrics.observe('task.duration', time() - started, label=self.name)
+        self.scraper.task_ctx.name = None
+        self.scraper.task_ctx.id = None
 
     def queue(self, *args, **kwargs):
         """ Schedule a task for execution. The task call (and its
@@ -153,12 +500,20 @@ class Task(object):
         """ Queue a first item to execute, then wait for the queue to
         be empty before returning. This should be the default way of
         starting any scraper.
+
+        If the ``journal`` setting is enabled and an earlier run was
+        interrupted, the calls it left pending are queued instead of
+        the first item.
         """
         if self._source is not None:
             return self._source.run(*args, **kwargs)
-        else:
+        journal = self.scraper.journal
+        if journal is None or not journal.resume():
             self.queue(*args, **kwargs)
-            return self.wait()
+        self.wait()
+        if journal is not None:
+            journal.clear()
+        return self
 
     def chain(self, other_task):
         """ Add a chain listener to the execution of this task. Whenever
@@ -0,0 +1,119 @@
+"""
+Rate limits and concurrency caps for HTTP requests, applied separately
+for each host. This makes it possible to be gentle with a fragile site
+without slowing down requests to any other host.
+"""
+from time import time, sleep
+from threading import Lock, BoundedSemaphore
+from contextlib import contextmanager
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+
+class TokenBucket(object):
+    """ A token bucket which allows ``rate`` requests per second on
+    average, with bursts of up to ``burst`` requests. """
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = time()
+        self.lock = Lock()
+
+    def reserve(self):
+        """ Take a token from the bucket and return the number of seconds
+        the caller needs to wait before it may be used. """
+        with self.lock:
+            now = time()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+
+
+class Throttle(object):
+    """ Keeps a token bucket and a concurrency limit for each host that
+    requests are made to. """
+
+    def __init__(self, metrics, rate=0, burst=1, concurrency=0):
+        """
+        :param rate: The number of requests per second allowed for
+            each host, or ``0`` to disable rate limiting.
+        :param burst: The number of requests which can be made in a
+            row before the rate limit takes effect.
+        :param concurrency: The number of requests that can be made to
+            a host at the same time, or ``0`` for no limit.
+        """
+        self.metrics = metrics
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.concurrency = int(concurrency)
+        self.lock = Lock()
+        self.buckets = {}
+        self.semaphores = {}
+
+    @property
+    def enabled(self):
+        return self.rate > 0 or self.concurrency > 0
+
+    def _get(self, registry, host, factory):
+        with self.lock:
+            if host not in registry:
+                registry[host] = factory()
+            return registry[host]
+
+    @contextmanager
+    def limit(self, url, blocking):
+        """ Wait until a request to the host of ``url`` is allowed, and
+        hold a concurrency slot for that host until the block exits.
+
+        :param blocking: A context manager factory which is used to wrap
+            any actual waiting, to let the task manager know that the
+            current worker is not available for other work.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        host = urlparse(url).netloc.lower()
+        started = time()
+        delay = 0
+        if self.rate > 0:
+            bucket = self._get(self.buckets, host,
+                               lambda: TokenBucket(self.rate, self.burst))
+            delay = bucket.reserve()
+
+        semaphore = None
+        if self.concurrency > 0:
+            semaphore = self._get(self.semaphores, host,
+                                  lambda: BoundedSemaphore(self.concurrency))
+
+        if delay > 0 or (semaphore and not semaphore.acquire(False)):
+            with blocking():
+                if delay > 0:
+                    sleep(delay)
+                if semaphore is not None:
+                    semaphore.acquire()
+            self.metrics.incr('throttle.waits', label=host)
+            self.metrics.incr('throttle.wait_time', time() - started,
+                              label=host)
+        try:
+            yield
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+
+def make_throttle(scraper):
+    """ Create the throttle for a scraper, based on its configuration. """
+    config = scraper.config
+    return Throttle(scraper.metrics,
+                    rate=config.rate_limit,
+                    burst=config.rate_burst,
+                    concurrency=config.host_concurrency)
@@ -33,7 +33,11 @@ setup(
         "Jinja2>=2.7.3",
         "python-json-logger>=0.0.5"
     ],
-    tests_require=[],
+    extras_require={
+        'msgpack': ["msgpack>=1.0"],
+        'zstd': ["zstandard>=0.15"]
+    },
+    tests_require=["pytest"],
     entry_points={
         'console_scripts': []
     }
@@ -0,0 +1,45 @@
+import os
+import sys
+import logging
+
+import pytest
+
+# the stand-in web site used by the benchmarks.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'benchmarks'))
+
+from server import StandInServer  # noqa
+
+from scrapekit import Scraper  # noqa
+
+
+@pytest.fixture
+def server():
+    server = StandInServer().start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def make_scraper(tmp_path, request):
+    """ Create scrapers which keep their data in a temporary directory.
+    The log handlers they add are removed after the test. """
+    root = logging.getLogger('')
+    handlers = list(root.handlers)
+    names = []
+
+    def make(**config):
+        config.setdefault('data_path', str(tmp_path / 'data'))
+        config.setdefault('threads', 4)
+        config.setdefault('log_buffer', 0)
+        names.append('%s-%d' % (request.node.name, len(names)))
+        scraper = Scraper(names[-1], config=config)
+        root.setLevel(logging.WARNING)
+        return scraper
+
+    yield make
+    for handler in list(root.handlers):
+        if handler not in handlers:
+            root.removeHandler(handler)
+            handler.close()
@@ -0,0 +1,85 @@
+import time
+
+import pytest
+
+from server import StandInServer
+
+
+@pytest.fixture
+def plain_server():
+    """ A server which sends no cache headers (and no ``Date``). """
+    server = StandInServer(cache_headers=False).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_no_cache(make_scraper, server):
+    scraper = make_scraper(cache_policy='none')
+    scraper.get(server.url + '/page')
+    scraper.get(server.url + '/page')
+    assert server.requests == 2
+
+
+def test_http_cache(make_scraper, server):
+    scraper = make_scraper(cache_policy='http')
+    first = scraper.get(server.url + '/page')
+    second = scraper.get(server.url + '/page')
+    assert second.content == first.content
+    assert server.requests == 1
+    assert scraper.metrics.get('cache.requests_avoided[http]') == 1
+    assert scraper.metrics.get('cache.bytes_avoided[http]') == \
+        len(first.content)
+
+
+def test_max_age_without_date(make_scraper, plain_server):
+    scraper = make_scraper(cache_policy='max-age=60')
+    first = scraper.get(plain_server.url + '/page')
+    second = scraper.get(plain_server.url + '/page')
+    assert 'Date' not in first.headers
+    assert second.content == first.content
+    assert plain_server.requests == 1
+
+
+def test_max_age_expires(make_scraper, server):
+    scraper = make_scraper(cache_policy='max-age=1')
+    scraper.get(server.url + '/page')
+    time.sleep(1.1)
+    # the stale copy is revalidated, which makes it fresh again.
+    response = scraper.get(server.url + '/page')
+    assert response.revalidated
+    scraper.get(server.url + '/page')
+    assert server.requests == 2
+    assert scraper.metrics.get('cache.requests_avoided[max-age=1]') == 1
+
+
+def test_revalidate(make_scraper, server):
+    scraper = make_scraper(cache_policy='revalidate')
+    first = scraper.get(server.url + '/page')
+    second = scraper.get(server.url + '/page')
+    assert second.revalidated
+    assert second.content == first.content
+    assert server.requests == 2
+    assert scraper.metrics.get('cache.requests_avoided[revalidate]') == 0
+
+
+def test_force_stream(make_scraper, server):
+    scraper = make_scraper(cache_policy='force')
+    body = scraper.get(server.url + '/page').content
+    response = scraper.get(server.url + '/page', stream=True)
+    assert response.from_cache
+    # counting the cache hit does not read the body.
+    assert not response._content_consumed
+    assert scraper.metrics.get('cache.bytes_avoided[force]') == len(body)
+    assert response.content == body
+    assert server.requests == 1
+
+
+def test_memory_cache(make_scraper, server):
+    # room for two pages of about 10 kB.
+    scraper = make_scraper(cache_policy='force', cache_memory=25000)
+    for path in ['/a', '/a', '/a', '/b', '/b', '/c', '/c']:
+        scraper.get(server.url + path)
+    assert server.requests == 3
+    assert scraper.metrics.get('cache.memory_hits') == 1
+    assert scraper.metrics.get('cache.memory_evictions') == 1
@@ -0,0 +1,59 @@
+from threading import Thread
+
+import pytest
+
+from server import StandInServer
+
+
+@pytest.fixture
+def slow_server():
+    server = StandInServer(latency=0.3).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def fetch_all(requests):
+    """ Run the given calls at the same time, and return their
+    responses. """
+    responses = [None] * len(requests)
+
+    def fetch(i, fn, args, kwargs):
+        responses[i] = fn(*args, **kwargs)
+
+    threads = [Thread(target=fetch, args=(i,) + call)
+               for i, call in enumerate(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return responses
+
+
+def test_coalescing(make_scraper, slow_server):
+    scraper = make_scraper(cache_policy='revalidate')
+    url = slow_server.url + '/page'
+    responses = fetch_all([(scraper.get, (url,), {})] * 5)
+    assert slow_server.requests == 1
+    assert scraper.metrics.get('http.coalesced') == 4
+    assert len(set(r.content for r in responses)) == 1
+
+
+def test_coalescing_by_method(make_scraper, slow_server):
+    scraper = make_scraper(cache_policy='revalidate')
+    url = slow_server.url + '/page'
+    get, head = fetch_all([(scraper.get, (url,), {}),
+                           (scraper.head, (url,), {})])
+    assert slow_server.requests == 2
+    assert len(get.content) > 0
+    assert head.content == b''
+
+
+def test_no_coalescing_when_streaming(make_scraper, slow_server):
+    scraper = make_scraper(cache_policy='revalidate')
+    url = slow_server.url + '/page'
+    responses = fetch_all([(scraper.get, (url,), {'stream': True})] * 3)
+    assert slow_server.requests == 3
+    assert scraper.metrics.get('http.coalesced') == 0
+    for response in responses:
+        assert len(response.content) > 0
@@ -0,0 +1,103 @@
+import os
+import hashlib
+
+import pytest
+
+from scrapekit.exc import DownloadException
+
+
+def test_download(make_scraper, server, tmp_path):
+    scraper = make_scraper()
+    path = str(tmp_path / 'file.html')
+    body = server.page('/file')
+    checksum = 'sha256:' + hashlib.sha256(body).hexdigest()
+    scraper.download(server.url + '/file', path, checksum=checksum)
+    with open(path, 'rb') as fh:
+        assert fh.read() == body
+
+
+def test_download_gzip(make_scraper, tmp_path):
+    from server import StandInServer
+    server = StandInServer(gzip=True).start()
+    try:
+        scraper = make_scraper()
+        path = str(tmp_path / 'file.html')
+        body = server.page('/file')
+        # a normal request gets a compressed response.
+        response = scraper.get(server.url + '/file', cache='none')
+        assert response.headers['Content-Encoding'] == 'gzip'
+        checksum = 'sha256:' + hashlib.sha256(body).hexdigest()
+        server.cut_after, server.cuts = 1000, 1
+        scraper.download(server.url + '/file', path, checksum=checksum)
+        with open(path, 'rb') as fh:
+            assert fh.read() == body
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_download_resume(make_scraper, server, tmp_path):
+    scraper = make_scraper()
+    path = str(tmp_path / 'file.html')
+    body = server.page('/file')
+    server.cut_after, server.cuts = 1000, 2
+    scraper.download(server.url + '/file', path, retries=3)
+    with open(path, 'rb') as fh:
+        assert fh.read() == body
+    assert server.requests == 3
+
+
+def test_download_resume_later(make_scraper, server, tmp_path):
+    scraper = make_scraper()
+    path = str(tmp_path / 'file.html')
+    body = server.page('/file')
+    server.cut_after, server.cuts = 1000, 1
+    with pytest.raises(DownloadException):
+        scraper.download(server.url + '/file', path, retries=0)
+    with open(path + '.part', 'rb') as fh:
+        assert fh.read() == body[:1000]
+    scraper.download(server.url + '/file', path, retries=0)
+    with open(path, 'rb') as fh:
+        assert fh.read() == body
+
+
+def test_download_complete_part(make_scraper, server, tmp_path):
+    scraper = make_scraper()
+    path = str(tmp_path / 'file.html')
+    body = server.page('/file')
+    with open(path + '.part', 'wb') as fh:
+        fh.write(body)
+    # the server answers 416, as there is nothing left to send.
+    scraper.download(server.url + '/file', path)
+    with open(path, 'rb') as fh:
+        assert fh.read() == body
+    assert server.requests == 1
+
+
+def test_download_checksum_mismatch(make_scraper, server, tmp_path):
+    scraper = make_scraper()
+    path = str(tmp_path / 'file.html')
+    with pytest.raises(DownloadException):
+        scraper.download(server.url + '/file', path,
+                         checksum='sha256:' + '0' * 64)
+
+
+def test_download_large_resume(make_scraper, server, tmp_path):
+    import resource
+    scraper = make_scraper()
+    path = str(tmp_path / 'large.bin')
+    size = 2 * 1024 ** 3
+    # the transfer breaks off half way, and is resumed.
+    server.cut_after, server.cuts = size // 2, 1
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    try:
+        scraper.download('%s/files/%d' % (server.url, size), path,
+                         size=size)
+        after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        assert os.path.getsize(path) == size
+        assert server.requests == 2
+        # the body is streamed to disk, not held in memory (in kB).
+        assert after - before < 64 * 1024
+    finally:
+        if os.path.exists(path):
+            os.unlink(path)
@@ -0,0 +1,91 @@
+from threading import Thread
+
+from scrapekit.journal import make_journal
+
+
+def make_tasks(scraper, calls):
+
+    @scraper.task
+    def source(count):
+        for i in range(count):
+            yield i
+
+    @scraper.task
+    def work(i):
+        calls.append(i)
+
+    source | work
+    return source, work
+
+
+def interrupt(make_scraper, done, producer=False):
+    """ Leave a journal behind as if the run was killed after the calls
+    of ``work`` in ``done`` had completed. With ``producer``, the call
+    of ``source`` which queued them was still pending as well. """
+    scraper = make_scraper(journal=True)
+    source, work = make_tasks(scraper, [])
+    journal = scraper.journal
+    if producer:
+        journal.queued(source, (5,), {})
+    for i in range(5):
+        journal.queued(work, (i,), {})
+    for i in done:
+        journal.done(work.key((i,), {}))
+    journal.flush()
+
+
+def test_resume(make_scraper):
+    interrupt(make_scraper, [0, 1])
+    calls = []
+    scraper = make_scraper(journal=True)
+    source, work = make_tasks(scraper, calls)
+    source.run(5)
+    assert sorted(calls) == [2, 3, 4]
+    # the journal is cleared once the run has finished.
+    assert not scraper.journal.pending
+    assert not scraper.journal.completed
+
+
+def test_resume_pipe(make_scraper):
+    interrupt(make_scraper, [0, 1], producer=True)
+    calls = []
+    scraper = make_scraper(journal=True)
+    source, work = make_tasks(scraper, calls)
+    source.run(5)
+    # the producer runs again, but its pending output is not repeated.
+    assert sorted(calls) == [2, 3, 4]
+
+
+def test_resume_without_threads(make_scraper):
+    interrupt(make_scraper, [0, 1], producer=True)
+    calls = []
+    scraper = make_scraper(journal=True, threads=0)
+    source, work = make_tasks(scraper, calls)
+    runner = Thread(target=source.run, args=(5,))
+    runner.daemon = True
+    runner.start()
+    runner.join(10)
+    assert not runner.is_alive()
+    assert sorted(calls) == [2, 3, 4]
+
+
+def test_resume_skips_completed_calls(make_scraper):
+    interrupt(make_scraper, [0, 1])
+    calls = []
+    scraper = make_scraper(journal=True, dedup=False)
+    source, work = make_tasks(scraper, calls)
+    work.queue(1)
+    work.queue(3)
+    work.wait()
+    assert calls == [3]
+    assert scraper.metrics.get('journal.skipped[work]') == 1
+
+
+def test_journal_settings(make_scraper):
+    scraper = make_scraper(journal='no')
+    assert scraper.journal is None
+    scraper = make_scraper(journal='yes', queue_backend=' Memory ')
+    assert scraper.journal is not None
+    scraper = make_scraper(journal='on', queue_backend='SQLite')
+    assert scraper.config.queue_backend == 'sqlite'
+    assert make_journal(scraper) is None
@@ -0,0 +1,153 @@
+import json
+import logging
+from threading import Thread
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+from logging.handlers import QueueListener
+
+from scrapekit.logs import RecordQueueHandler, stop_listener, log_path
+from scrapekit.metrics import Metrics
+
+
+class ListHandler(logging.Handler):
+
+    def __init__(self):
+        super(ListHandler, self).__init__()
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+def record(message, level=logging.INFO):
+    return logging.makeLogRecord({'msg': message, 'levelno': level,
+                                  'levelname': logging.getLevelName(level)})
+
+
+def drain(queue):
+    messages = []
+    while not queue.empty():
+        messages.append(queue.get_nowait().getMessage())
+    return messages
+
+
+def fill(overflow, count=10, size=5):
+    queue, metrics = Queue(maxsize=size), Metrics()
+    handler = RecordQueueHandler(queue, overflow=overflow, metrics=metrics)
+    for i in range(count):
+        handler.handle(record('record %d' % i))
+    return queue, metrics, handler
+
+
+def test_overflow_drop_new():
+    queue, metrics, handler = fill('drop_new')
+    assert drain(queue) == ['record %d' % i for i in range(5)]
+    assert metrics.get('log.dropped') == 5
+
+
+def test_overflow_drop_old():
+    queue, metrics, handler = fill('drop_old')
+    assert drain(queue) == ['record %d' % i for i in range(5, 10)]
+    assert metrics.get('log.dropped') == 5
+
+
+def wait_for_space(handler, queue, message):
+    """ Emit a record into a full queue from another thread, and check
+    that it waits until a record has been taken off the queue. """
+    thread = Thread(target=handler.handle, args=(message,))
+    thread.daemon = True
+    thread.start()
+    thread.join(0.2)
+    assert thread.is_alive()
+    queue.get_nowait()
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def test_overflow_block():
+    queue, metrics, handler = fill('block', count=5)
+    wait_for_space(handler, queue, record('late'))
+    assert drain(queue)[-1] == 'late'
+    assert metrics.get('log.dropped') == 0
+
+
+def test_warnings_are_kept():
+    queue, metrics, handler = fill('drop_new', count=5)
+    wait_for_space(handler, queue, record('warning', logging.WARNING))
+    assert drain(queue)[-1] == 'warning'
+    assert metrics.get('log.dropped') == 0
+
+
+def test_stop_listener():
+    logger = logging.getLogger('test_stop_listener')
+    logger.propagate = False
+    queue = Queue(maxsize=100)
+    queue_handler = RecordQueueHandler(queue)
+    target = ListHandler()
+    listener = QueueListener(queue, target)
+    logger.addHandler(queue_handler)
+    listener.start()
+    for i in range(50):
+        logger.warning('record %d', i)
+    stop_listener(logger, queue_handler, listener)
+    assert target.messages == ['record %d' % i for i in range(50)]
+    # records emitted later are written directly.
+    logger.warning('late')
+    assert target.messages[-1] == 'late'
+    logger.removeHandler(target)
+
+
+def test_flush(make_scraper):
+    scraper = make_scraper(log_buffer=100)
+    for i in range(20):
+        scraper.log.warning('record %d', i)
+    scraper.log.flush()
+    with open(log_path(scraper)) as fh:
+        messages = [json.loads(line)['message'] for line in fh]
+    assert messages[-20:] == ['record %d' % i for i in range(20)]
+
+
+def test_sampling(make_scraper):
+    scraper = make_scraper(log_sample=4)
+    logger = scraper.log.logger
+    target = ListHandler()
+    logger.addHandler(target)
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    try:
+        for i in range(20):
+            scraper.log.debug('debug %d', i)
+        for level in (logging.INFO, logging.WARNING, logging.ERROR):
+            scraper.log.log(level, 'level %d', level)
+    finally:
+        logger.removeHandler(target)
+        logger.propagate = True
+    debug = [m for m in target.messages if m.startswith('debug')]
+    assert debug == ['debug %d' % i for i in range(0, 20, 4)]
+    assert len(target.messages) == 5 + 3
+
+
+def test_context(make_scraper):
+    scraper = make_scraper()
+    base = scraper.log.context()
+    assert 'taskName' not in base
+    assert base['scraperId'] == str(scraper.id)
+    scraper.task_ctx.name, scraper.task_ctx.id = 'work', 'id-1'
+    try:
+        context = scraper.log.context()
+        assert context['taskName'] == 'work'
+        assert context['taskId'] == 'id-1'
+        # the context of a task is built once.
+        assert scraper.log.context() is context
+        scraper.task_ctx.id = 'id-2'
+        assert scraper.log.context()['taskId'] == 'id-2'
+        msg, kwargs = scraper.log.process('message', {'extra': {'a': 1}})
+        assert kwargs['extra']['a'] == 1
+        assert kwargs['extra']['taskId'] == 'id-2'
+        assert 'a' not in scraper.log.context()
+    finally:
+        scraper.task_ctx.name, scraper.task_ctx.id = None, None
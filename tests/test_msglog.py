@@ -0,0 +1,47 @@
+import json
+import multiprocessing
+
+import pytest
+
+from scrapekit import Scraper
+from scrapekit.logs import msglog_paths
+from scrapekit.reporting import db
+
+pytest.importorskip('msgpack')
+
+
+def log_run(data_path, label):
+    scraper = Scraper('shared', config={'data_path': data_path,
+                                        'log_format': 'msgpack',
+                                        'log_buffer': 0})
+    for i in range(50):
+        scraper.log.warning('%s %d', label, i)
+
+
+def test_msglog_processes(make_scraper, tmp_path):
+    # the fixture removes the log handlers added by the test.
+    make_scraper()
+    data_path = str(tmp_path / 'shared')
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=log_run, args=(data_path, label))
+                 for label in ('first', 'second')]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+    scraper = Scraper('shared', config={'data_path': data_path,
+                                        'log_format': 'msgpack',
+                                        'log_buffer': 0,
+                                        'report_db': ':memory:'})
+    assert len(msglog_paths(scraper)) == 3
+    conn = db.connect(scraper)
+    try:
+        db.load(scraper, conn)
+        rows = db.query(conn, 'SELECT data FROM log')
+        messages = [json.loads(row['data'])['message'] for row in rows]
+    finally:
+        conn.close()
+    expected = ['%s %d' % (label, i) for label in ('first', 'second')
+                for i in range(50)]
+    assert sorted(messages) == sorted(expected)
@@ -0,0 +1,83 @@
+import time
+from threading import Barrier, get_ident, Lock
+
+from scrapekit.tasks import TaskManager, PoolSizer
+
+
+def snapshot(active=0, depth=0, waits=0, requests=0, request_time=0.0):
+    return {'active': active, 'depth': depth, 'waits': waits,
+            'requests': requests, 'request_time': request_time}
+
+
+def make_sizer(threads=8):
+    return PoolSizer(TaskManager(threads=threads, max_threads=threads * 4))
+
+
+def test_grow_when_busy():
+    sizer = make_sizer()
+    assert sizer.size(snapshot(), snapshot(active=8, depth=20)) == 16
+    # workers are idle while tasks wait: nothing to gain.
+    assert sizer.size(snapshot(), snapshot(active=4, depth=20)) == 8
+
+
+def test_shrink_when_idle():
+    sizer = make_sizer()
+    assert sizer.size(snapshot(), snapshot(active=2)) == 5
+    assert sizer.size(snapshot(), snapshot(active=7)) == 7
+
+
+def test_shrink_when_throttled():
+    sizer = make_sizer()
+    now = snapshot(active=8, depth=20, waits=3)
+    assert sizer.size(snapshot(), now) == 6
+
+
+def test_shrink_when_slow():
+    sizer = make_sizer()
+    last = snapshot(active=8, depth=20)
+    now = snapshot(active=8, depth=20, requests=10, request_time=1.0)
+    assert sizer.size(last, now) == 16
+    # the response time grows from 0.1 to 0.5 seconds.
+    later = snapshot(active=8, depth=20, requests=20, request_time=6.0)
+    assert sizer.size(now, later) == 6
+
+
+def test_resize(make_scraper):
+    scraper = make_scraper(threads=2, threads_max=6)
+    manager = scraper.task_manager
+    idents, lock = set(), Lock()
+
+    @scraper.task
+    def noop(i):
+        pass
+
+    noop.queue(0)
+    noop.wait()
+    manager.resize(100)
+    assert manager.num_threads == 6
+    # all six workers can run at the same time.
+    barrier = Barrier(6, timeout=5)
+
+    @scraper.task
+    def meet(i):
+        barrier.wait()
+
+    for i in range(6):
+        meet.queue(i)
+    meet.wait()
+    assert not barrier.broken
+
+    manager.resize(0)
+    assert manager.num_threads == 2
+    time.sleep(0.1)
+
+    @scraper.task
+    def record(i):
+        with lock:
+            idents.add(get_ident())
+        time.sleep(0.01)
+
+    for i in range(40):
+        record.queue(i)
+    record.wait()
+    assert len(idents) <= 2
@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+from scrapekit.exc import ScraperException
+
+
+def test_process_executor(make_scraper):
+    scraper = make_scraper(processes=2)
+    results = []
+
+    @scraper.task(executor='process')
+    def square(i):
+        return [(i * i, os.getpid())]
+
+    @scraper.task
+    def sink(item):
+        results.append(item)
+
+    square | sink
+    for i in range(10):
+        square.queue(i)
+    square.wait()
+    assert sorted(v for (v, pid) in results) == [i * i for i in range(10)]
+    assert os.getpid() not in [pid for (v, pid) in results]
+    scraper.process_pool.shutdown()
+
+
+def test_process_task_defined_late(make_scraper):
+    scraper = make_scraper(processes=1)
+
+    @scraper.task(executor='process')
+    def early(i):
+        return i
+
+    early.run(1)
+
+    @scraper.task(executor='process')
+    def late(i):
+        return i
+
+    with pytest.raises(ScraperException):
+        scraper.process_pool.call(late, (1,), {})
+    scraper.process_pool.shutdown()
@@ -0,0 +1,35 @@
+def test_profile_threads(make_scraper):
+    # the background thread never samples, the test does.
+    scraper = make_scraper(profile=True, profile_interval=3600)
+
+    @scraper.task
+    def work():
+        scraper.profiler.sample()
+
+    work.queue()
+    work.wait()
+    tasks = scraper.profiler.results()['tasks']
+    assert tasks['work']['samples'] == 1
+    names = [f['function'] for f in tasks['work']['functions']]
+    assert any(name.startswith('work ') for name in names)
+
+
+def test_profile_asyncio(make_scraper):
+    scraper = make_scraper(engine='asyncio', profile=True,
+                           profile_interval=3600)
+
+    @scraper.task
+    async def fetch():
+        scraper.profiler.sample()
+
+    @scraper.task
+    def parse():
+        scraper.profiler.sample()
+
+    fetch.queue()
+    parse.queue()
+    fetch.wait()
+    tasks = scraper.profiler.results()['tasks']
+    # coroutines share the thread of the event loop.
+    assert 'fetch' not in tasks
+    assert tasks['parse']['samples'] == 1
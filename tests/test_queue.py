@@ -0,0 +1,46 @@
+import time
+
+from scrapekit.scheduler import SQLiteTaskQueue
+
+
+def test_sqlite_pipeline(make_scraper):
+    scraper = make_scraper(queue_backend='sqlite')
+    results = []
+
+    @scraper.task
+    def source(count):
+        for i in range(count):
+            yield i
+
+    @scraper.task
+    def double(i):
+        return [i * 2]
+
+    @scraper.task
+    def sink(i):
+        results.append(i)
+
+    source | double | sink
+    source.run(30)
+    assert sorted(results) == [i * 2 for i in range(30)]
+
+
+def test_sqlite_shared_queue(make_scraper, tmp_path):
+    path = str(tmp_path / 'queue.sqlite')
+    scraper = make_scraper(queue_backend='sqlite', queue_path=path,
+                           queue_timeout=60)
+    calls = []
+
+    @scraper.task
+    def work(i):
+        calls.append(i)
+
+    # calls queued by another process, one of which has died while
+    # working on its call.
+    other = SQLiteTaskQueue(path, {'work': work})
+    for i in range(5):
+        other.put((work, (i,), {}))
+    other.conn.execute("UPDATE queue SET claimed = ? WHERE id = 1",
+                       (time.time() - 120,))
+    work.wait()
+    assert sorted(calls) == [0, 1, 2, 3, 4]
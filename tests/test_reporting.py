@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+from scrapekit import reporting
+from scrapekit.reporting import render
+
+
+def test_report_without_runs(make_scraper):
+    scraper = make_scraper()
+    assert reporting.generate(scraper) is None
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_report(make_scraper, processes):
+    scraper = make_scraper(report_processes=processes)
+
+    @scraper.task
+    def work(i):
+        scraper.log.warning('Working on %s', i)
+
+    for i in range(5):
+        work.queue(i)
+    work.wait()
+    scraper.log.flush()
+    index_file = reporting.generate(scraper)
+    assert os.path.exists(index_file)
+    # a second report only renders what changed, and finds the pages.
+    assert reporting.generate(scraper) == index_file
+
+
+def test_renderer_is_inline_by_default(make_scraper):
+    renderer = render.Renderer(make_scraper())
+    assert renderer.pool is None
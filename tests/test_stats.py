@@ -0,0 +1,80 @@
+import json
+import time
+
+import requests
+
+from scrapekit.stats import StatsServer, prometheus_text
+
+
+def run_tasks(scraper):
+
+    @scraper.task
+    def work(i):
+        if i == 2:
+            raise ValueError('boom')
+
+    for i in range(3):
+        work.queue(i)
+    work.wait()
+
+
+def test_collect(make_scraper):
+    scraper = make_scraper(threads=2)
+    stats = scraper.stats()
+    assert stats['queue'] == {'depth': 0, 'workers': 2, 'utilization': 0.0}
+    # collecting statistics does not set up the task manager.
+    assert scraper._task_manager is None
+    run_tasks(scraper)
+    task = scraper.stats()['tasks']['work']
+    assert task['calls'] == 3
+    assert task['errors'] == 1
+    assert task['active'] == 0
+    assert task['duration']['count'] == 3
+
+
+def test_prometheus_text(make_scraper):
+    scraper = make_scraper()
+    run_tasks(scraper)
+    lines = prometheus_text(scraper).splitlines()
+    assert 'scrapekit_task_calls_total{task="work"} 3' in lines
+    assert 'scrapekit_task_errors_total{task="work"} 1' in lines
+    assert '# TYPE scrapekit_task_active gauge' in lines
+    assert 'scrapekit_task_duration_seconds_count{task="work"} 3' in lines
+    assert 'scrapekit_task_duration_seconds_bucket{task="work",le="+Inf"} 3' \
+        in lines
+    assert 'scrapekit_queue_workers 4' in lines
+
+
+def test_stats_file(make_scraper, tmp_path):
+    path = str(tmp_path / 'stats.prom')
+    scraper = make_scraper(stats_file=path, journal=True,
+                           queue_backend='sqlite')
+    # the writer starts at once, without setting up the task manager.
+    for i in range(100):
+        try:
+            with open(path) as fh:
+                text = fh.read()
+            break
+        except IOError:
+            time.sleep(0.01)
+    assert 'scrapekit_elapsed_seconds' in text
+    assert scraper._task_manager is None
+    assert scraper.task_manager.queue_factory.shared
+
+
+def test_stats_server(make_scraper):
+    scraper = make_scraper()
+    run_tasks(scraper)
+    server = StatsServer(scraper, 0)
+    server.start()
+    try:
+        url = 'http://127.0.0.1:%d' % server.server_address[1]
+        stats = json.loads(requests.get(url + '/stats').text)
+        assert stats['tasks']['work']['calls'] == 3
+        response = requests.get(url + '/metrics')
+        assert response.headers['Content-Type'].startswith('text/plain')
+        assert 'scrapekit_task_calls_total{task="work"} 3' in response.text
+        assert requests.get(url + '/other').status_code == 404
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,82 @@
+from threading import Thread
+
+import pytest
+
+
+@pytest.mark.parametrize('engine', ['threads', 'asyncio'])
+def test_pipeline(make_scraper, engine):
+    scraper = make_scraper(engine=engine)
+    results = []
+
+    @scraper.task
+    def source(count):
+        for i in range(count):
+            yield i
+
+    @scraper.task
+    def double(i):
+        return [i * 2]
+
+    @scraper.task
+    def sink(i):
+        results.append(i)
+
+    source | double | sink
+    source.run(50)
+    assert sorted(results) == [i * 2 for i in range(50)]
+
+
+def test_async_fetch(make_scraper, server):
+    scraper = make_scraper(engine='asyncio', cache_policy='none')
+    sizes = []
+
+    @scraper.task
+    async def fetch(i):
+        response = await scraper.aio.get('%s/page/%d' % (server.url, i))
+        sizes.append(len(response.content))
+
+    for i in range(20):
+        fetch.queue(i)
+    fetch.wait()
+    assert len(sizes) == 20
+    assert server.requests == 20
+
+
+def test_dedup(make_scraper):
+    scraper = make_scraper(dedup=True)
+    calls = []
+
+    @scraper.task
+    def work(i):
+        calls.append(i)
+
+    for i in [1, 2, 1, 3, 2]:
+        work.queue(i)
+    work.wait()
+    assert sorted(calls) == [1, 2, 3]
+
+
+def test_fan_out_backpressure(make_scraper):
+    # every worker runs a producer, which queues far more items than
+    # the queue holds (threads * 10).
+    scraper = make_scraper(threads=2)
+    results = []
+
+    @scraper.task
+    def produce(n):
+        for i in range(500):
+            yield (n, i)
+
+    @scraper.task
+    def consume(item):
+        results.append(item)
+
+    produce | consume
+    for n in range(4):
+        produce.queue(n)
+    runner = Thread(target=produce.wait)
+    runner.daemon = True
+    runner.start()
+    runner.join(30)
+    assert not runner.is_alive(), 'the pipeline is deadlocked'
+    assert len(results) == 2000
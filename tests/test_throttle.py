@@ -0,0 +1,34 @@
+import time
+from threading import Thread
+
+
+def test_rate_limit(make_scraper, server):
+    scraper = make_scraper(cache_policy='none', rate_limit=20, rate_burst=1)
+    started = time.time()
+    for i in range(6):
+        scraper.get('%s/page/%d' % (server.url, i))
+    # the first request is allowed at once, the others every 50 ms.
+    assert time.time() - started >= 0.25
+    host = server.url.split('//')[1]
+    assert scraper.metrics.get('throttle.waits[%s]' % host) >= 4
+
+
+def test_host_concurrency(make_scraper):
+    from server import StandInServer
+    server = StandInServer(latency=0.1).start()
+    try:
+        scraper = make_scraper(cache_policy='none', host_concurrency=1)
+        threads = [Thread(target=scraper.get,
+                          args=('%s/page/%d' % (server.url, i),))
+                   for i in range(4)]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # one request at a time.
+        assert time.time() - started >= 0.4
+        assert server.requests == 4
+    finally:
+        server.shutdown()
+        server.server_close()